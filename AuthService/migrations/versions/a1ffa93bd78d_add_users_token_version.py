@@ -0,0 +1,28 @@
+"""add users token_version
+
+Revision ID: a1ffa93bd78d
+Revises: 838e4f0666bb
+Create Date: 2026-10-17 18:40:12.518303
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a1ffa93bd78d'
+down_revision: Union[str, Sequence[str], None] = '838e4f0666bb'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('users', sa.Column('token_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('users', 'token_version')
@@ -12,9 +12,19 @@ class Settings(BaseSettings):
     ACCESS_TOKEN_EXPIRE_MINUTES: int
     PUBLIC_KEY: str
     DB_ENGINE_ECHO: bool
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30
+    DB_POOL_RECYCLE: int = -1
+    DB_POOL_PRE_PING: bool = False
+    DB_STATEMENT_CACHE_SIZE: int = 100
+    DB_PGBOUNCER: bool = False
     RABBIT_HOST: str
     RABBIT_USER: str
     RABBIT_PASS: str
+    RABBIT_CHANNEL_POOL_SIZE: int = 4
+    OUTBOX_BATCH_SIZE: int = 100
+    OUTBOX_POLL_INTERVAL: float = 1.0
 
     @property
     def DATABASE_URL_asyncpg(self):
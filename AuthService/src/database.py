@@ -1,12 +1,40 @@
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from uuid import uuid4
+
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import NullPool
 from config import settings
 
+
+def engine_options() -> dict:
+    if settings.DB_PGBOUNCER:
+        # PgBouncer in transaction mode does the pooling and cannot keep
+        # prepared statements across transactions.
+        return {
+            "echo": settings.DB_ENGINE_ECHO,
+            "poolclass": NullPool,
+            "connect_args": {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+            },
+        }
+    return {
+        "echo": settings.DB_ENGINE_ECHO,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+        "connect_args": {"statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE},
+    }
+
+
 async_engine = create_async_engine(
     url=settings.DATABASE_URL_asyncpg,
-    echo=settings.DB_ENGINE_ECHO
+    **engine_options()
 )
 
 Session = async_sessionmaker(async_engine)
 
-class Base(DeclarativeBase): pass
\ No newline at end of file
+class Base(DeclarativeBase): pass
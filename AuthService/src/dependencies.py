@@ -48,6 +48,6 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> UserInDB:
         raise credentials_exception
     
     user = await get_user(username)
-    if not user:
+    if not user or user.disabled or payload.get("ver", 0) < user.token_version:
         raise credentials_exception
     return user
@@ -0,0 +1,144 @@
+"""Replay dead-lettered user events.
+
+Messages rejected by the MessageService and UserService consumers land in
+the user_events_dead_letter queue. This tool moves them back at a bounded
+rate. Each message is republished to the queue that rejected it, so a
+replay does not hit the databases of services that already processed the
+event:
+
+    python src/dlx_replay.py --dry-run
+    python src/dlx_replay.py --rate 50 --batch-size 50 --event-type UserRegistered
+
+A message is acked in the dead-letter queue only after the broker confirmed
+its republish. Messages that are filtered out or cannot be parsed stay in
+the dead-letter queue.
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+
+import aio_pika
+from aio_pika.abc import AbstractChannel, AbstractExchange, AbstractIncomingMessage
+
+from config import settings
+from events import EXCHANGE_NAME
+
+DEAD_LETTER_EXCHANGE = "dlx_user_events"
+DEAD_LETTER_QUEUE = "user_events_dead_letter"
+
+
+def event_type(message: AbstractIncomingMessage) -> str | None:
+    try:
+        return json.loads(message.body.decode())["type"]
+    except Exception:
+        return None
+
+
+def origin_queue(message: AbstractIncomingMessage) -> str | None:
+    deaths = (message.headers or {}).get("x-death")
+    if not deaths:
+        return None
+    queue = deaths[0].get("queue") # type: ignore
+    return queue.decode() if isinstance(queue, bytes) else queue
+
+
+def replay_message(message: AbstractIncomingMessage) -> aio_pika.Message:
+    return aio_pika.Message(
+        body=message.body,
+        content_type=message.content_type,
+        message_id=message.message_id,
+        delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+        headers={"x-replayed-from": DEAD_LETTER_QUEUE},
+    )
+
+
+async def republish(channel: AbstractChannel, exchange: AbstractExchange, message: AbstractIncomingMessage):
+    queue = origin_queue(message)
+    if queue:
+        await channel.default_exchange.publish(replay_message(message), routing_key=queue)
+    else:
+        await exchange.publish(replay_message(message), routing_key="")
+
+
+async def declare_dead_letter_queue(channel: AbstractChannel):
+    exchange = await channel.declare_exchange(
+        name=DEAD_LETTER_EXCHANGE,
+        type=aio_pika.ExchangeType.FANOUT,
+        durable=True)
+    queue = await channel.declare_queue(name=DEAD_LETTER_QUEUE, durable=True)
+    await queue.bind(exchange)
+    return queue
+
+
+async def replay(args: argparse.Namespace) -> Counter:
+    counts: Counter = Counter()
+    connection = await aio_pika.connect_robust(
+        host=settings.RABBIT_HOST,
+        login=settings.RABBIT_USER,
+        password=settings.RABBIT_PASS
+    )
+    async with connection:
+        channel = await connection.channel(publisher_confirms=True)
+        queue = await declare_dead_letter_queue(channel)
+        exchange = await channel.declare_exchange(
+            name=EXCHANGE_NAME,
+            type=aio_pika.ExchangeType.FANOUT,
+            durable=True)
+        pending = queue.declaration_result.message_count
+        print(f"{pending} messages in {DEAD_LETTER_QUEUE}")
+
+        # Skipped messages stay unacked until the channel closes, which keeps
+        # get() from returning them again and puts them back in the queue.
+        seen = 0
+        while args.limit is None or counts["replayed"] < args.limit:
+            started = time.monotonic()
+            batch = []
+            while len(batch) < args.batch_size and seen < pending:
+                message = await queue.get(no_ack=False, fail=False)
+                if message is None:
+                    break
+                seen += 1
+                kind = event_type(message)
+                if kind is None:
+                    counts["unparseable"] += 1
+                elif args.event_type and kind not in args.event_type:
+                    counts[f"skipped {kind}"] += 1
+                elif args.dry_run:
+                    counts[f"would replay {kind} to {origin_queue(message) or EXCHANGE_NAME}"] += 1
+                else:
+                    batch.append(message)
+                    if args.limit is not None and counts["replayed"] + len(batch) >= args.limit:
+                        break
+            if not batch:
+                break
+
+            await asyncio.gather(*(republish(channel, exchange, message) for message in batch))
+            for message in batch:
+                await message.ack()
+            counts["replayed"] += len(batch)
+            print(f"replayed {counts['replayed']}")
+
+            delay = len(batch) / args.rate - (time.monotonic() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+    return counts
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=50, help="messages per second")
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=None, help="stop after replaying this many messages")
+    parser.add_argument("--event-type", action="append", help="only replay this event type, may be repeated")
+    parser.add_argument("--dry-run", action="store_true", help="count messages without replaying them")
+    args = parser.parse_args()
+
+    counts = await replay(args)
+    for key, count in sorted(counts.items()):
+        print(f"{key}: {count}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
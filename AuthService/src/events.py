@@ -1,33 +1,165 @@
+import asyncio
 import aio_pika
 import json
 
+from aio_pika.abc import AbstractChannel, AbstractRobustConnection
+from aio_pika.pool import Pool
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
 from config import settings
+from database import Session
+from models import OutboxOrm
+
+EXCHANGE_NAME = "user_events"
+
+
+def user_registered_event(user_id: int, username: str | None) -> dict:
+    return {
+        "type": "UserRegistered",
+        "data": {
+            "user_id": user_id,
+            "username": username,
+        }
+    }
+
+
+def user_access_changed_event(user_id: int, token_version: int, disabled: bool) -> dict:
+    return {
+        "type": "UserAccessChanged",
+        "data": {
+            "user_id": user_id,
+            "token_version": token_version,
+            "disabled": disabled,
+        }
+    }
+
+
+def add_outbox_event(db: AsyncSession, event: dict):
+    db.add(OutboxOrm(event_type=event["type"], payload=event))
+
+
+class EventPublisher:
+    def __init__(self, pool_size: int):
+        self.pool_size = pool_size
+        self.connection: AbstractRobustConnection | None = None
+        self.channels: Pool[AbstractChannel] | None = None
+        self.lock = asyncio.Lock()
+
+    async def start(self):
+        async with self.lock:
+            if self.connection is None:
+                self.connection = await aio_pika.connect_robust(
+                    host=settings.RABBIT_HOST,
+                    login=settings.RABBIT_USER,
+                    password=settings.RABBIT_PASS
+                )
+                self.channels = Pool(self.open_channel, max_size=self.pool_size)
+
+    async def open_channel(self) -> AbstractChannel:
+        channel = await self.connection.channel(publisher_confirms=True) # type: ignore
+        await channel.declare_exchange(
+            name=EXCHANGE_NAME,
+            type=aio_pika.ExchangeType.FANOUT,
+            durable=True
+        )
+        return channel
+
+    async def publish(self, events: list[tuple[int, dict]]):
+        await self.start()
+        async with self.channels.acquire() as channel: # type: ignore
+            exchange = await channel.get_exchange(EXCHANGE_NAME, ensure=False)
+            # Publishing concurrently on one confirming channel waits for all
+            # broker confirms together instead of one round trip per event.
+            await asyncio.gather(*(
+                exchange.publish(
+                    aio_pika.Message(
+                        body=json.dumps(event).encode('utf-8'),
+                        message_id=str(event_id),
+                        delivery_mode=aio_pika.DeliveryMode.PERSISTENT
+                    ),
+                    routing_key=""
+                )
+                for event_id, event in events
+            ))
+
+    async def stop(self):
+        if self.channels is not None:
+            await self.channels.close()
+            self.channels = None
+        if self.connection is not None:
+            await self.connection.close()
+            self.connection = None
+
+
+class OutboxRelay:
+    def __init__(self, publisher: EventPublisher, batch_size: int, poll_interval: float):
+        self.publisher = publisher
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.wakeup = asyncio.Event()
+        self.task: asyncio.Task | None = None
+        self.batches = 0
+        self.published = 0
+
+    def wake(self):
+        self.wakeup.set()
+
+    async def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            try:
+                drained = await self.drain()
+            except Exception as e:
+                print(f"Error relaying outbox events: {e}")
+                await asyncio.sleep(self.poll_interval)
+                continue
+
+            if drained < self.batch_size:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def drain(self) -> int:
+        async with Session() as db:
+            # SKIP LOCKED lets several instances relay without publishing the
+            # same rows; rows are deleted only after the broker confirmed them.
+            events = list(await db.scalars(
+                select(OutboxOrm)
+                .order_by(OutboxOrm.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            ))
+            if not events:
+                return 0
+
+            await self.publisher.publish([(event.id, event.payload) for event in events])
+            await db.execute(delete(OutboxOrm).where(OutboxOrm.id.in_([event.id for event in events])))
+            await db.commit()
+
+        self.batches += 1
+        self.published += len(events)
+        return len(events)
+
 
-async def send_user_created_event(user_id: int, username: str | None):
-    connection = await aio_pika.connect_robust(host=settings.RABBIT_HOST, login=settings.RABBIT_USER, password=settings.RABBIT_PASS)
-
-    async with connection:
-        channel = await connection.channel()
-
-        exchange = await channel.declare_exchange(
-        name="user_events",
-        type=aio_pika.ExchangeType.FANOUT,
-        durable=True)
-
-        event = {
-            "type": "UserRegistered",
-            "data": {
-                "user_id": user_id,
-                "username": username,
-            }
-        }   
-
-        message = aio_pika.Message(
-        body=json.dumps(event).encode('utf-8'),
-        delivery_mode=aio_pika.DeliveryMode.PERSISTENT)
-        
-        await exchange.publish(
-        message,
-        routing_key="")
-
-        await channel.close()
\ No newline at end of file
+event_publisher = EventPublisher(pool_size=settings.RABBIT_CHANNEL_POOL_SIZE)
+outbox_relay = OutboxRelay(
+    publisher=event_publisher,
+    batch_size=settings.OUTBOX_BATCH_SIZE,
+    poll_interval=settings.OUTBOX_POLL_INTERVAL
+)
@@ -3,14 +3,16 @@ from datetime import datetime, timedelta, timezone
 from passlib.context import CryptContext
 
 from fastapi import FastAPI, Depends, HTTPException, status, BackgroundTasks
+from fastapi.concurrency import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordRequestForm
 
+from sqlalchemy import update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 import jwt
 import uvicorn
-from events import send_user_created_event
+from events import add_outbox_event, event_publisher, outbox_relay, user_access_changed_event, user_registered_event
 from models import UserOrm
 from schemas import UserResponse, UserInDB, UserCreate, Token
 from dependencies import get_user, get_current_user, get_db
@@ -19,7 +21,16 @@ from config import settings
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await outbox_relay.start()
+
+    yield
+
+    await outbox_relay.stop()
+    await event_publisher.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -39,7 +50,7 @@ def get_password_hash(password: str) -> str:
 
 async def authenticate_user(username: str, password: str) -> UserInDB | None:
     user = await get_user(username)
-    if not user or not verify_password(password, user.hashed_password):
+    if not user or user.disabled or not verify_password(password, user.hashed_password):
         return None
     return user
 
@@ -72,11 +83,10 @@ async def register_user(user_data: UserCreate, background_tasks: BackgroundTasks
     await db.flush()
     await db.refresh(user_in_db)
 
-    background_tasks.add_task(
-        send_user_created_event,
-        user_id=user_in_db.id,
-        username=user_in_db.username
-    )
+    # The event is committed together with the user and published by the
+    # outbox relay; the background task only wakes it up after the commit.
+    add_outbox_event(db, user_registered_event(user_in_db.id, user_in_db.username))
+    background_tasks.add_task(outbox_relay.wake)
     
     return user_in_db
 
@@ -93,7 +103,7 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data={"sub": user.username, "uid": user.id, "ver": user.token_version}, expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -103,6 +113,20 @@ async def read_users_me(current_user: UserInDB = Depends(get_current_user)):
     return current_user
 
 
+@app.post("/users/me/revoke-tokens", status_code=status.HTTP_204_NO_CONTENT)
+async def revoke_tokens(background_tasks: BackgroundTasks,
+                        current_user: UserInDB = Depends(get_current_user),
+                        db: AsyncSession = Depends(get_db)):
+    token_version = await db.scalar(update(UserOrm)
+                                    .where(UserOrm.id == current_user.id)
+                                    .values(token_version=UserOrm.token_version + 1)
+                                    .returning(UserOrm.token_version))
+    # Other services reject tokens with an older "ver" claim once they
+    # receive this event.
+    add_outbox_event(db, user_access_changed_event(current_user.id, token_version, bool(current_user.disabled))) # type: ignore
+    background_tasks.add_task(outbox_relay.wake)
+
+
 @app.get("/protected")
 async def protected_route(current_user: UserInDB = Depends(get_current_user)):
     return {
@@ -1,3 +1,7 @@
+import datetime
+
+from sqlalchemy import BigInteger, text
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import Mapped, mapped_column
 from database import Base
 
@@ -8,4 +12,14 @@ class UserOrm(Base):
     username: Mapped[str]
     email: Mapped[str | None]
     hashed_password: Mapped[str]
-    disabled: Mapped[bool | None]
\ No newline at end of file
+    disabled: Mapped[bool | None]
+    token_version: Mapped[int] = mapped_column(default=0, server_default="0")
+
+
+class OutboxOrm(Base):
+    __tablename__ = "outbox"
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    event_type: Mapped[str]
+    payload: Mapped[dict] = mapped_column(JSONB)
+    created_at: Mapped[datetime.datetime] = mapped_column(server_default=text("TIMEZONE('utc', now())"))
@@ -17,6 +17,7 @@ class UserResponse(UserBase):
 class UserInDB(UserResponse):
     id: int
     hashed_password: str
+    token_version: int = 0
 
     class Config:
         from_attributes = True
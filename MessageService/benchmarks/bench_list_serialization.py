@@ -0,0 +1,98 @@
+"""Compare CPU per message page for the ORM/pydantic and column/orjson paths.
+
+The ORM path is the one GET /chats/{chat_id}/messages used before: load
+MessageOrm objects, model_validate each one, then let FastAPI validate
+and serialize the list against response_model. The fast path selects
+the columns as row mappings and encodes them with orjson. Both read the
+same page from the database configured in .env, bypassing the recent
+messages cache, and the script checks that they produce the same JSON:
+
+    python benchmarks/bench_list_serialization.py --chat-id 1
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+
+import crud
+from database import Session, async_engine
+from models import MessageOrm
+from schemas import MessageResponse
+
+response_field = create_model_field(name="response", type_=list[MessageResponse], mode="serialization")
+
+
+def page_query(chat_id: int, limit: int, *columns):
+    return (
+        select(*columns)
+        .where(MessageOrm.chat_id == chat_id)
+        .order_by(MessageOrm.sent_at.desc(), MessageOrm.id.desc())
+        .limit(limit)
+    )
+
+
+async def orm_page(chat_id: int, limit: int) -> bytes:
+    async with Session() as db:
+        result = await db.scalars(
+            page_query(chat_id, limit, MessageOrm).options(selectinload(MessageOrm.sender))
+        )
+        messages = [MessageResponse.model_validate(message) for message in result]
+    content = await serialize_response(field=response_field, response_content=messages)
+    return JSONResponse(content).body
+
+
+async def fast_page(chat_id: int, limit: int) -> bytes:
+    async with Session() as db:
+        result = await db.execute(page_query(chat_id, limit, *crud.message_columns()))
+        messages = [dict(row) for row in result.mappings()]
+    return ORJSONResponse(messages).body
+
+
+async def measure(label: str, page, args: argparse.Namespace) -> float:
+    for _ in range(args.warmup):
+        await page(args.chat_id, args.limit)
+
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    for _ in range(args.pages):
+        await page(args.chat_id, args.limit)
+    cpu_per_page = (time.process_time() - cpu) / args.pages
+    wall_per_page = (time.perf_counter() - wall) / args.pages
+
+    print(f"{label:>14}: {cpu_per_page * 1000:7.3f} ms CPU/page  {wall_per_page * 1000:7.3f} ms wall/page")
+    return cpu_per_page
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chat-id", type=int, required=True)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=20)
+    args = parser.parse_args()
+
+    orm_body = await orm_page(args.chat_id, args.limit)
+    fast_body = await fast_page(args.chat_id, args.limit)
+    if json.loads(orm_body) != json.loads(fast_body):
+        raise SystemExit("the two paths returned different pages")
+    print(f"{len(json.loads(fast_body))} messages per page, identical JSON")
+
+    orm_cpu = await measure("orm+pydantic", orm_page, args)
+    fast_cpu = await measure("columns+orjson", fast_page, args)
+    print(f"{'':>14}  {orm_cpu / fast_cpu:.1f}x less CPU per page")
+
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+"""Compare per-request message inserts with the batched MessageWriter.
+
+Runs against the database configured in .env and inserts real rows into
+the given chat, so point it at a disposable database:
+
+    python benchmarks/bench_message_writer.py --chat-id 1 --sender-id 1
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import crud
+from database import Session, async_engine
+from message_writer import message_writer
+from schemas import MessageCreate
+
+
+async def send_one(chat_id: int, sender_id: int, latencies: list[float]):
+    started = time.perf_counter()
+    async with Session() as db:
+        message = await crud.create_message(db, MessageCreate(content="benchmark", chat_id=chat_id), sender_id)
+        await db.commit()
+    if message is None:
+        raise SystemExit("sender is not a participant of the chat")
+    latencies.append(time.perf_counter() - started)
+
+
+async def run(label: str, args: argparse.Namespace):
+    latencies: list[float] = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def worker():
+        async with semaphore:
+            await send_one(args.chat_id, args.sender_id, latencies)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(
+        f"{label:>12}: {args.requests / elapsed:8.0f} msg/s  "
+        f"p50 {statistics.median(latencies) * 1000:7.2f} ms  "
+        f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:7.2f} ms"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chat-id", type=int, required=True)
+    parser.add_argument("--sender-id", type=int, required=True)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=message_writer.batch_size)
+    parser.add_argument("--window-ms", type=float, default=message_writer.window * 1000)
+    args = parser.parse_args()
+
+    await run("per-request", args)
+
+    message_writer.batch_size = args.batch_size
+    message_writer.window = args.window_ms / 1000
+    await message_writer.start()
+    try:
+        await run("batched", args)
+    finally:
+        await message_writer.stop()
+    print(f"{'':>12}  {message_writer.stats()}")
+
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
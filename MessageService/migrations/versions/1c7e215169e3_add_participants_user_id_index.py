@@ -0,0 +1,28 @@
+"""add participants user_id index
+
+Revision ID: 1c7e215169e3
+Revises: 946bb605f506
+Create Date: 2026-10-17 11:02:19.541870
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1c7e215169e3'
+down_revision: Union[str, Sequence[str], None] = '946bb605f506'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_participants_user_id', 'participants', ['user_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_participants_user_id', table_name='participants')
@@ -0,0 +1,36 @@
+"""add messages content search
+
+Revision ID: 327b364778f5
+Revises: 458c77507a1f
+Create Date: 2026-10-17 14:05:31.402817
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '327b364778f5'
+down_revision: Union[str, Sequence[str], None] = '458c77507a1f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('messages', sa.Column(
+        'content_tsv',
+        postgresql.TSVECTOR(),
+        sa.Computed("to_tsvector('simple', content)", persisted=True),
+        nullable=True
+    ))
+    op.create_index('ix_messages_content_tsv', 'messages', ['content_tsv'], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_messages_content_tsv', table_name='messages', postgresql_using='gin')
+    op.drop_column('messages', 'content_tsv')
@@ -0,0 +1,119 @@
+"""partition messages
+
+Revision ID: 458c77507a1f
+Revises: 4c80eed92e02
+Create Date: 2026-10-17 13:20:44.108352
+
+"""
+import datetime
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '458c77507a1f'
+down_revision: Union[str, Sequence[str], None] = '4c80eed92e02'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# The layout is fixed when this revision runs, so it does not depend on the
+# service config. Override the defaults with -x, e.g.
+#   alembic -x messages_partitioning=hash -x messages_hash_partitions=32 upgrade head
+DEFAULT_OPTIONS = {
+    'messages_partitioning': 'range',
+    'messages_hash_partitions': 16,
+    'messages_partition_premake_months': 3,
+}
+
+INDEXES = [
+    ('ix_messages_id', ['id']),
+    ('ix_messages_chat_id_sent_at_id', ['chat_id', 'sent_at', 'id']),
+    ('ix_messages_chat_id_id', ['chat_id', 'id']),
+]
+
+
+def migration_option(name: str):
+    default = DEFAULT_OPTIONS[name]
+    value = context.get_x_argument(as_dictionary=True).get(name)
+    return default if value is None else type(default)(value)
+
+
+def add_months(month: datetime.date, months: int) -> datetime.date:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def create_messages_table(name: str, primary_key: str, partition_by: str | None) -> None:
+    op.execute(f"""
+        CREATE TABLE {name} (
+            id integer NOT NULL DEFAULT nextval('messages_id_seq'),
+            chat_id integer NOT NULL,
+            sender_id integer NOT NULL,
+            content varchar NOT NULL,
+            sent_at timestamp without time zone NOT NULL DEFAULT TIMEZONE('utc', now()),
+            edited_at timestamp without time zone NOT NULL DEFAULT TIMEZONE('utc', now()),
+            edited boolean NOT NULL,
+            CONSTRAINT messages_pkey PRIMARY KEY ({primary_key}),
+            CONSTRAINT messages_chat_id_fkey FOREIGN KEY (chat_id) REFERENCES chats (id) ON DELETE CASCADE,
+            CONSTRAINT messages_sender_id_fkey FOREIGN KEY (sender_id) REFERENCES users (id)
+        ) {f"PARTITION BY {partition_by}" if partition_by else ""}
+    """)
+
+
+def swap_messages_table(create_new) -> None:
+    for index_name, _ in INDEXES:
+        op.drop_index(index_name, table_name='messages')
+    op.execute("ALTER TABLE messages RENAME TO messages_old")
+    for constraint in ('messages_pkey', 'messages_chat_id_fkey', 'messages_sender_id_fkey'):
+        op.execute(f"ALTER TABLE messages_old RENAME CONSTRAINT {constraint} TO {constraint}_old")
+
+    create_new()
+
+    op.execute("""
+        INSERT INTO messages (id, chat_id, sender_id, content, sent_at, edited_at, edited)
+        SELECT id, chat_id, sender_id, content, sent_at, edited_at, edited
+        FROM messages_old
+    """)
+    op.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages.id")
+    op.execute("DROP TABLE messages_old")
+
+    for index_name, columns in INDEXES:
+        op.create_index(index_name, 'messages', columns, unique=False)
+
+
+def create_partitioned_messages() -> None:
+    if migration_option('messages_partitioning') == "hash":
+        create_messages_table('messages', 'id, chat_id', 'HASH (chat_id)')
+        modulus = migration_option('messages_hash_partitions')
+        for remainder in range(modulus):
+            op.execute(
+                f"CREATE TABLE messages_h{remainder:02d} PARTITION OF messages "
+                f"FOR VALUES WITH (MODULUS {modulus}, REMAINDER {remainder})"
+            )
+        return
+
+    create_messages_table('messages', 'id, sent_at', 'RANGE (sent_at)')
+    first_sent_at = op.get_bind().scalar(sa.text("SELECT min(sent_at) FROM messages_old"))
+    current = datetime.datetime.now(datetime.timezone.utc).date().replace(day=1)
+    month = first_sent_at.date().replace(day=1) if first_sent_at else current
+    last = add_months(current, migration_option('messages_partition_premake_months'))
+    while month <= last:
+        op.execute(
+            f"CREATE TABLE messages_p{month.year:04d}_{month.month:02d} PARTITION OF messages "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+        )
+        month = add_months(month, 1)
+    op.execute("CREATE TABLE messages_default PARTITION OF messages DEFAULT")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    swap_messages_table(create_partitioned_messages)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    swap_messages_table(lambda: create_messages_table('messages', 'id', None))
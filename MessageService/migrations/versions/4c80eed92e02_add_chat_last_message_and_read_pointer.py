@@ -0,0 +1,44 @@
+"""add chat last message and read pointer
+
+Revision ID: 4c80eed92e02
+Revises: 1c7e215169e3
+Create Date: 2026-10-17 11:48:03.917422
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4c80eed92e02'
+down_revision: Union[str, Sequence[str], None] = '1c7e215169e3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('chats', sa.Column('last_message_id', sa.Integer(), nullable=True))
+    op.add_column('chats', sa.Column('last_message_at', sa.DateTime(), nullable=True))
+    op.add_column('participants', sa.Column('last_read_message_id', sa.Integer(), nullable=True))
+    op.create_index('ix_messages_chat_id_id', 'messages', ['chat_id', 'id'], unique=False)
+    op.execute("""
+        UPDATE chats
+        SET last_message_id = latest.id, last_message_at = latest.sent_at
+        FROM (
+            SELECT DISTINCT ON (chat_id) chat_id, id, sent_at
+            FROM messages
+            ORDER BY chat_id, sent_at DESC, id DESC
+        ) AS latest
+        WHERE latest.chat_id = chats.id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_messages_chat_id_id', table_name='messages')
+    op.drop_column('participants', 'last_read_message_id')
+    op.drop_column('chats', 'last_message_at')
+    op.drop_column('chats', 'last_message_id')
@@ -0,0 +1,48 @@
+"""add chat message seq
+
+Revision ID: 540e0a5102c5
+Revises: 327b364778f5
+Create Date: 2026-10-17 14:52:09.615378
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '540e0a5102c5'
+down_revision: Union[str, Sequence[str], None] = '327b364778f5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('chats', sa.Column('last_seq', sa.BigInteger(), server_default='0', nullable=False))
+    op.add_column('messages', sa.Column('seq', sa.BigInteger(), nullable=True))
+    op.execute("""
+        UPDATE messages
+        SET seq = numbered.seq
+        FROM (
+            SELECT id, sent_at, row_number() OVER (PARTITION BY chat_id ORDER BY sent_at, id) AS seq
+            FROM messages
+        ) AS numbered
+        WHERE messages.id = numbered.id AND messages.sent_at = numbered.sent_at
+    """)
+    op.execute("""
+        UPDATE chats
+        SET last_seq = latest.seq
+        FROM (SELECT chat_id, max(seq) AS seq FROM messages GROUP BY chat_id) AS latest
+        WHERE latest.chat_id = chats.id
+    """)
+    op.alter_column('messages', 'seq', nullable=False)
+    op.create_index('ix_messages_chat_id_seq', 'messages', ['chat_id', 'seq'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_messages_chat_id_seq', table_name='messages')
+    op.drop_column('messages', 'seq')
+    op.drop_column('chats', 'last_seq')
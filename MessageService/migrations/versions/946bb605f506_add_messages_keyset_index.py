@@ -0,0 +1,28 @@
+"""add messages keyset index
+
+Revision ID: 946bb605f506
+Revises: 4937daade3c8
+Create Date: 2026-10-17 10:12:41.203118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '946bb605f506'
+down_revision: Union[str, Sequence[str], None] = '4937daade3c8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_messages_chat_id_sent_at_id', 'messages', ['chat_id', 'sent_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_messages_chat_id_sent_at_id', table_name='messages')
@@ -0,0 +1,30 @@
+"""add users access fields
+
+Revision ID: a1886ebb98c9
+Revises: 540e0a5102c5
+Create Date: 2026-10-17 18:42:37.104512
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a1886ebb98c9'
+down_revision: Union[str, Sequence[str], None] = '540e0a5102c5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('users', sa.Column('token_version', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('users', sa.Column('disabled', sa.Boolean(), server_default=sa.false(), nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('users', 'disabled')
+    op.drop_column('users', 'token_version')
@@ -0,0 +1,188 @@
+import asyncio
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, Set
+
+from config import settings
+from redis_manager import get_redis
+
+MessageHandler = Callable[[int, str], Awaitable[None]]
+ControlHandler = Callable[[str], Awaitable[None]]
+
+
+class Backplane(ABC):
+    @abstractmethod
+    async def start(self, handler: MessageHandler, control_handler: ControlHandler): ...
+
+    @abstractmethod
+    async def stop(self): ...
+
+    @abstractmethod
+    async def subscribe(self, chat_id: int): ...
+
+    @abstractmethod
+    async def unsubscribe(self, chat_id: int): ...
+
+    @abstractmethod
+    async def publish(self, chat_id: int, message: str): ...
+
+    @abstractmethod
+    async def publish_control(self, message: str): ...
+
+
+class InMemoryBroker:
+    def __init__(self):
+        self.subscribers: Dict[int, Set["InMemoryBackplane"]] = defaultdict(set)
+        self.backplanes: Set["InMemoryBackplane"] = set()
+
+    async def publish(self, chat_id: int, message: str):
+        for backplane in list(self.subscribers.get(chat_id, ())):
+            await backplane.deliver(chat_id, message)
+
+    async def publish_control(self, message: str):
+        for backplane in list(self.backplanes):
+            await backplane.deliver_control(message)
+
+
+class InMemoryBackplane(Backplane):
+    def __init__(self, broker: InMemoryBroker | None = None):
+        self.broker = broker or InMemoryBroker()
+        self.handler: MessageHandler | None = None
+        self.control_handler: ControlHandler | None = None
+
+    async def start(self, handler: MessageHandler, control_handler: ControlHandler):
+        self.handler = handler
+        self.control_handler = control_handler
+        self.broker.backplanes.add(self)
+
+    async def stop(self):
+        for subscribers in self.broker.subscribers.values():
+            subscribers.discard(self)
+        self.broker.backplanes.discard(self)
+        self.handler = None
+        self.control_handler = None
+
+    async def subscribe(self, chat_id: int):
+        self.broker.subscribers[chat_id].add(self)
+
+    async def unsubscribe(self, chat_id: int):
+        self.broker.subscribers[chat_id].discard(self)
+        if not self.broker.subscribers[chat_id]:
+            del self.broker.subscribers[chat_id]
+
+    async def publish(self, chat_id: int, message: str):
+        await self.broker.publish(chat_id, message)
+
+    async def publish_control(self, message: str):
+        await self.broker.publish_control(message)
+
+    async def deliver(self, chat_id: int, message: str):
+        if self.handler is not None:
+            await self.handler(chat_id, message)
+
+    async def deliver_control(self, message: str):
+        if self.control_handler is not None:
+            await self.control_handler(message)
+
+
+class RedisBackplane(Backplane):
+    channel_prefix = "chat:"
+    control_channel = "chat_control"
+
+    def __init__(self):
+        self.handler: MessageHandler | None = None
+        self.control_handler: ControlHandler | None = None
+        self.pubsub = None
+        self.reader_task: asyncio.Task | None = None
+        self.chats: Set[int] = set()
+        self.reconnects = 0
+
+    def channel(self, chat_id: int) -> str:
+        return f"{self.channel_prefix}{chat_id}"
+
+    async def start(self, handler: MessageHandler, control_handler: ControlHandler):
+        self.handler = handler
+        self.control_handler = control_handler
+        self.pubsub = get_redis().pubsub() # type: ignore
+        # Every worker listens on the control channel, whatever chats its
+        # sockets are subscribed to.
+        await self.pubsub.subscribe(self.control_channel) # type: ignore
+        self.reader_task = asyncio.create_task(self.reader())
+
+    async def stop(self):
+        if self.reader_task is not None:
+            self.reader_task.cancel()
+            self.reader_task = None
+        if self.pubsub is not None:
+            await self.pubsub.aclose()
+            self.pubsub = None
+
+    async def subscribe(self, chat_id: int):
+        # Recorded first so that a reconnect picks the chat up even if this
+        # subscribe hits a broken connection.
+        self.chats.add(chat_id)
+        try:
+            await self.pubsub.subscribe(self.channel(chat_id)) # type: ignore
+        except Exception as e:
+            print(f"Error subscribing to chat {chat_id}, retrying on reconnect: {e}")
+
+    async def unsubscribe(self, chat_id: int):
+        self.chats.discard(chat_id)
+        try:
+            await self.pubsub.unsubscribe(self.channel(chat_id)) # type: ignore
+        except Exception as e:
+            print(f"Error unsubscribing from chat {chat_id}: {e}")
+
+    async def publish(self, chat_id: int, message: str):
+        await get_redis().publish(self.channel(chat_id), message) # type: ignore
+
+    async def publish_control(self, message: str):
+        await get_redis().publish(self.control_channel, message) # type: ignore
+
+    async def reader(self):
+        failed = False
+        while self.pubsub is not None:
+            try:
+                if failed:
+                    await self.reconnect()
+                    failed = False
+                await self.read()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Backplane subscriber failed, reconnecting: {e}")
+                failed = True
+                await asyncio.sleep(1)
+
+    async def reconnect(self):
+        self.reconnects += 1
+        try:
+            await self.pubsub.aclose() # type: ignore
+        except Exception:
+            pass
+        self.pubsub = get_redis().pubsub() # type: ignore
+        await self.pubsub.subscribe(self.control_channel, *(self.channel(chat_id) for chat_id in self.chats)) # type: ignore
+
+    async def read(self):
+        while self.pubsub is not None:
+            message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0) # type: ignore
+            if message is None or message["type"] != "message":
+                continue
+            channel = message["channel"].decode()
+            if channel == self.control_channel:
+                try:
+                    await self.control_handler(message["data"].decode()) # type: ignore
+                except Exception as e:
+                    print(f"Error handling control message: {e}")
+                continue
+            chat_id = int(channel.removeprefix(self.channel_prefix))
+            try:
+                await self.handler(chat_id, message["data"].decode()) # type: ignore
+            except Exception as e:
+                print(f"Error delivering message to chat {chat_id}: {e}")
+
+
+def create_backplane() -> Backplane:
+    if settings.BROADCAST_BACKEND == "redis":
+        return RedisBackplane()
+    return InMemoryBackplane()
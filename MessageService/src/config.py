@@ -10,14 +10,72 @@ class Settings(BaseSettings):
     ALGORITHM: str
     PUBLIC_KEY: str
     DB_ENGINE_ECHO: bool
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30
+    DB_POOL_RECYCLE: int = -1
+    DB_POOL_PRE_PING: bool = False
+    DB_STATEMENT_CACHE_SIZE: int = 100
+    DB_PGBOUNCER: bool = False
+    DB_REPLICA_HOST: str | None = None
+    DB_REPLICA_PORT: int | None = None
+    DB_READ_YOUR_WRITES_WINDOW: float = 5.0
     RABBIT_HOST: str
     RABBIT_USER: str
     RABBIT_PASS: str
+    USER_EVENTS_CONSUMER: str = "batch"
+    USER_EVENTS_PREFETCH: int = 200
+    USER_EVENTS_BATCH_SIZE: int = 100
+    USER_EVENTS_BATCH_WINDOW_MS: float = 50.0
+    REDIS_HOST: str = "redis"
+    REDIS_PASS: str = ""
+    BROADCAST_BACKEND: str = "memory"
+    WS_SEND_QUEUE_SIZE: int = 256
+    WS_SEND_TIMEOUT: float = 5.0
+    WS_REPLAY_LIMIT: int = 500
+    MESSAGE_WRITER_ENABLED: bool = False
+    MESSAGE_WRITER_BATCH_SIZE: int = 100
+    MESSAGE_WRITER_WINDOW_MS: float = 5.0
+    MEMBERSHIP_CACHE_SIZE: int = 10000
+    MEMBERSHIP_CACHE_TTL: float = 30.0
+    MEMBERSHIP_CACHE_REDIS: bool = False
+    MEMBERSHIP_CACHE_REDIS_TTL: int = 3600
+    RECENT_MESSAGES_CACHE_CHATS: int = 5000
+    RECENT_MESSAGES_CACHE_SIZE: int = 100
+    RECENT_MESSAGES_CACHE_TTL: float = 60.0
+    RECENT_MESSAGES_CACHE_REDIS: bool = False
+    RECENT_MESSAGES_CACHE_REDIS_TTL: int = 3600
+    READ_RECEIPTS_FLUSH_INTERVAL: float = 1.0
+    READ_RECEIPTS_MAX_PENDING: int = 5000
+    READ_RECEIPTS_KNOWN_SIZE: int = 100000
+    READ_RECEIPTS_MAX_RETRIES: int = 3
+    MESSAGES_PARTITION_PREMAKE_MONTHS: int = 3
+    MESSAGES_PARTITION_MAINTENANCE_INTERVAL: float = 3600
+    MESSAGES_RETENTION_MONTHS: int = 0
+    MESSAGES_RETENTION_MODE: str = "detach"
+    MESSAGES_DETACHED_RETENTION_MONTHS: int = 0
+    EXPORT_BATCH_SIZE: int = 1000
+    AUTH_MODE: str = "db"
+    AUTH_ACCESS_CHECK_TTL: float = 0
+
+    @property
+    def REDIS_REQUIRED(self):
+        return (
+            self.BROADCAST_BACKEND == "redis"
+            or self.MEMBERSHIP_CACHE_REDIS
+            or self.RECENT_MESSAGES_CACHE_REDIS
+            or bool(self.DB_REPLICA_HOST)
+        )
 
     @property
     def DATABASE_URL_asyncpg(self):
         return f"postgresql+asyncpg://{self.DB_USER}:{self.DB_PASS}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
     
+    @property
+    def DATABASE_URL_asyncpg_replica(self):
+        port = self.DB_REPLICA_PORT or self.DB_PORT
+        return f"postgresql+asyncpg://{self.DB_USER}:{self.DB_PASS}@{self.DB_REPLICA_HOST}:{port}/{self.DB_NAME}"
+    
     @property
     def DATABASE_URL_psycopg(self):
         return f"postgresql+psycopg2://{self.DB_USER}:{self.DB_PASS}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
@@ -1,10 +1,25 @@
-from sqlalchemy import select
+from datetime import datetime
+
+from sqlalchemy import Integer, and_, any_, bindparam, cast, delete, exists, func, select, tuple_
+from sqlalchemy.dialects.postgresql import ARRAY, REGCONFIG, insert
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import aliased
 from models import ChatOrm, ParticipantOrm, MessageOrm, UserOrm
-from schemas import ChatResponse, ChatCreate, MessageResponse, MessageCreate
+from schemas import (
+    ChatResponse, ChatCreate, MessageResponse, MessageCreate, MessageSearchResult, ParticipantsChange
+)
+from message_writer import message_writer, record_last_messages, reserve_seqs
+from membership_cache import membership_cache
+from database import mark_write
+from recent_messages import recent_messages
+
+UNREAD_COUNT_LIMIT = 1000
+# Same order as MessageResponse so rows encode to the same JSON.
+MESSAGE_FIELDS = ("content", "chat_id", "id", "seq", "sender_id", "sent_at", "edited")
+SEARCH_CONFIG = "simple"
+SEARCH_HEADLINE_OPTIONS = "StartSel=<mark>, StopSel=</mark>, MaxWords=35, MinWords=15"
 
-async def create_chat(db: AsyncSession, chat: ChatCreate) -> ChatResponse:
+async def create_chat(db: AsyncSession, chat: ChatCreate, creator_id: int) -> ChatResponse:
     db_chat = ChatOrm(
         is_group=chat.is_group,
         title=chat.title
@@ -12,66 +27,263 @@ async def create_chat(db: AsyncSession, chat: ChatCreate) -> ChatResponse:
     db.add(db_chat)
 
     await db.flush()
-    await db.refresh(db_chat, ["users"])
-
-    users = (await db.scalars(select(UserOrm)
-                                     .filter(UserOrm.id.in_(chat.users_ids)))).all()
-    for user in users:
-        db_chat.users.append(user)
-    
-
     await db.refresh(db_chat)
+
+    await add_participants(db, db_chat.id, {*chat.users_ids, creator_id})
+    await mark_write(creator_id)
     
     return ChatResponse.model_validate(db_chat)
 
-async def get_user_chats(db: AsyncSession, user_id: int) -> list[ChatResponse]:
-    result = await db.scalars(
-        select(ChatOrm)
-        .join(ParticipantOrm)
-        .where(ParticipantOrm.user_id == user_id)
-        .options(selectinload(ChatOrm.users))
+async def is_group_chat(db: AsyncSession, chat_id: int) -> bool:
+    return bool(await db.scalar(select(ChatOrm.is_group).where(ChatOrm.id == chat_id)))
+
+def user_ids_param(user_ids: set[int] | list[int]):
+    return bindparam("user_ids", sorted(set(user_ids)), type_=ARRAY(Integer))
+
+async def add_participants(db: AsyncSession, chat_id: int, user_ids: set[int] | list[int]) -> ParticipantsChange:
+    ids = user_ids_param(user_ids)
+    requested = func.unnest(ids).table_valued("id").render_derived(name="requested")
+
+    missing = await db.scalars(
+        select(requested.c.id)
+        .where(~exists().where(UserOrm.id == requested.c.id))
+    )
+    added = await db.scalars(
+        insert(ParticipantOrm)
+        .from_select(
+            ["chat_id", "user_id"],
+            select(bindparam("chat_id", chat_id, type_=Integer), UserOrm.id)
+            .where(UserOrm.id == any_(ids))
+        )
+        .on_conflict_do_nothing()
+        .returning(ParticipantOrm.user_id)
     )
-    return [ChatResponse.model_validate(chat) for chat in result] 
+    return ParticipantsChange(added=sorted(added), missing=sorted(missing))
 
-async def create_message(db: AsyncSession, message: MessageCreate, sender_id: int) -> MessageResponse | None:
-    participant = await db.scalar(
-        select(ParticipantOrm)
+async def remove_participants(db: AsyncSession, chat_id: int, user_ids: set[int] | list[int]) -> ParticipantsChange:
+    removed = await db.scalars(
+        delete(ParticipantOrm)
         .where(
-            ParticipantOrm.chat_id == message.chat_id,
-            ParticipantOrm.user_id == sender_id
+            ParticipantOrm.chat_id == chat_id,
+            ParticipantOrm.user_id == any_(user_ids_param(user_ids))
+        )
+        .returning(ParticipantOrm.user_id)
+    )
+    return ParticipantsChange(removed=sorted(removed))
+
+async def get_user_chats_version(db: AsyncSession, user_id: int) -> tuple:
+    result = await db.execute(
+        select(
+            func.count(),
+            func.max(ChatOrm.last_message_id),
+            func.sum(ParticipantOrm.last_read_message_id),
+            func.max(ParticipantOrm.joined_at)
+        )
+        .select_from(ParticipantOrm)
+        .join(ChatOrm, ChatOrm.id == ParticipantOrm.chat_id)
+        .where(ParticipantOrm.user_id == user_id)
+    )
+    return tuple(result.one())
+
+async def get_chat_last_seq(db: AsyncSession, chat_id: int) -> int:
+    return await db.scalar(select(ChatOrm.last_seq).where(ChatOrm.id == chat_id)) or 0
+
+def chat_activity_at():
+    return func.coalesce(ChatOrm.last_message_at, ChatOrm.created_at)
+
+def message_columns(message=MessageOrm, prefix: str = ""):
+    return [getattr(message, field).label(prefix + field) for field in MESSAGE_FIELDS]
+
+# The list endpoints below return plain dicts shaped like their response
+# models, so they can be encoded directly without a validation pass.
+async def get_user_chats(
+    db: AsyncSession,
+    user_id: int,
+    limit: int | None = None,
+    before: tuple[datetime, int] | None = None
+) -> list[tuple[dict, datetime]]:
+    last_message = aliased(MessageOrm)
+    activity_at = chat_activity_at()
+    unread_count = (
+        select(func.count())
+        .select_from(
+            select(MessageOrm.id)
+            .where(
+                MessageOrm.chat_id == ChatOrm.id,
+                MessageOrm.id > func.coalesce(ParticipantOrm.last_read_message_id, 0),
+                MessageOrm.sender_id != user_id
+            )
+            .limit(UNREAD_COUNT_LIMIT)
+            .correlate(ChatOrm, ParticipantOrm)
+            .subquery()
+        )
+        .scalar_subquery()
+    )
+
+    query = (
+        select(
+            ChatOrm.is_group, ChatOrm.title, ChatOrm.id, ChatOrm.created_at,
+            *message_columns(last_message, "last_message_"),
+            unread_count.label("unread_count"),
+            activity_at.label("activity_at")
         )
+        .join(ParticipantOrm, ParticipantOrm.chat_id == ChatOrm.id)
+        .outerjoin(
+            last_message,
+            and_(last_message.id == ChatOrm.last_message_id, last_message.sent_at == ChatOrm.last_message_at)
+        )
+        .where(ParticipantOrm.user_id == user_id)
+        .order_by(activity_at.desc(), ChatOrm.id.desc())
+        .limit(limit)
     )
-    if not participant:
+    if before is not None:
+        query = query.where(tuple_(activity_at, ChatOrm.id) < tuple_(*before))
+
+    result = await db.execute(query)
+    return [
+        (
+            {
+                "is_group": row["is_group"],
+                "title": row["title"],
+                "id": row["id"],
+                "created_at": row["created_at"],
+                "last_message": {
+                    field: row["last_message_" + field] for field in MESSAGE_FIELDS
+                } if row["last_message_id"] is not None else None,
+                "unread_count": row["unread_count"],
+            },
+            row["activity_at"]
+        )
+        for row in result.mappings()
+    ]
+
+async def get_user_chat_ids(db: AsyncSession, user_id: int) -> list[int]:
+    result = await db.scalars(
+        select(ParticipantOrm.chat_id)
+        .where(ParticipantOrm.user_id == user_id)
+    )
+    return list(result)
+
+async def message_in_chat(db: AsyncSession, chat_id: int, message_id: int) -> bool:
+    return bool(await db.scalar(
+        select(exists().where(MessageOrm.chat_id == chat_id, MessageOrm.id == message_id))
+    ))
+
+async def create_message(db: AsyncSession, message: MessageCreate, sender_id: int) -> MessageResponse | None:
+    if not await membership_cache.is_member(db, message.chat_id, sender_id):
         return None
+    await mark_write(sender_id)
+
+    if message_writer.running:
+        return await message_writer.submit(message, sender_id)
     
+    seqs = await reserve_seqs(db, {message.chat_id: 1})
     db_message = MessageOrm(
         **message.model_dump(),
-        sender_id=sender_id
+        sender_id=sender_id,
+        seq=seqs[message.chat_id]
     )
     db.add(db_message)
 
     await db.flush()
     await db.refresh(db_message)
 
-    return MessageResponse.model_validate(db_message)
+    response = MessageResponse.model_validate(db_message)
+    await record_last_messages(db, [response])
+    return response
 
-async def get_chat_messages(db: AsyncSession, chat_id: int, user_id: int, skip: int = 0, limit: int = 100) -> list[MessageResponse] | None:
-    participant = await db.scalar(
-        select(ParticipantOrm)
-        .where(
-            ParticipantOrm.chat_id == chat_id,
-            ParticipantOrm.user_id == user_id
-        )
+async def get_messages_since(db: AsyncSession, chat_id: int, since_seq: int, limit: int) -> list[MessageResponse]:
+    result = await db.scalars(
+        select(MessageOrm)
+        .where(MessageOrm.chat_id == chat_id, MessageOrm.seq > since_seq)
+        .order_by(MessageOrm.seq)
+        .limit(limit)
     )
-    if not participant:
+    return [MessageResponse.model_validate(message) for message in result]
+
+async def get_chat_messages(
+    db: AsyncSession,
+    chat_id: int,
+    user_id: int,
+    skip: int = 0,
+    limit: int = 100,
+    before: tuple[datetime, int] | None = None,
+    after: tuple[datetime, int] | None = None
+) -> list[dict] | None:
+    if not await membership_cache.is_member(db, chat_id, user_id):
         return None
     
-    result = await db.scalars(
-        select(MessageOrm)
+    first_page = skip == 0 and before is None and after is None
+    if first_page:
+        cached = await recent_messages.get(chat_id, limit)
+        if cached is not None:
+            return cached
+
+    query = (
+        select(*message_columns())
         .where(MessageOrm.chat_id == chat_id)
-        .order_by(MessageOrm.sent_at.desc())
-        .offset(skip)
         .limit(limit)
-        .options(selectinload(MessageOrm.sender))
     )
-    return [MessageResponse.model_validate(message) for message in result]
\ No newline at end of file
+    position = tuple_(MessageOrm.sent_at, MessageOrm.id)
+
+    # The plain sent_at bounds are redundant with the row comparison but let
+    # Postgres prune month partitions of the messages table.
+    if after is not None:
+        query = (
+            query
+            .where(MessageOrm.sent_at >= after[0], position > tuple_(*after))
+            .order_by(MessageOrm.sent_at, MessageOrm.id)
+        )
+        messages = [dict(row) for row in (await db.execute(query)).mappings()]
+        messages.reverse()
+        return messages
+
+    query = query.order_by(MessageOrm.sent_at.desc(), MessageOrm.id.desc())
+    if before is not None:
+        query = query.where(MessageOrm.sent_at <= before[0], position < tuple_(*before))
+    else:
+        query = query.offset(skip)
+
+    messages = [dict(row) for row in (await db.execute(query)).mappings()]
+    if first_page:
+        await recent_messages.store(chat_id, messages)
+    return messages
+
+def escape_html(value):
+    return func.replace(func.replace(func.replace(value, "&", "&amp;"), "<", "&lt;"), ">", "&gt;")
+
+async def search_messages(
+    db: AsyncSession,
+    user_id: int,
+    text_query: str,
+    chat_id: int | None = None,
+    limit: int = 20,
+    before: tuple[float, int] | None = None
+) -> list[MessageSearchResult]:
+    config = cast(SEARCH_CONFIG, REGCONFIG)
+    ts_query = func.websearch_to_tsquery(config, text_query)
+    rank = func.ts_rank_cd(MessageOrm.content_tsv, ts_query)
+
+    matches = (
+        select(
+            MessageOrm.id, MessageOrm.seq, MessageOrm.chat_id, MessageOrm.sender_id, MessageOrm.content,
+            MessageOrm.sent_at, MessageOrm.edited, rank.label("rank")
+        )
+        .join(ParticipantOrm, and_(ParticipantOrm.chat_id == MessageOrm.chat_id, ParticipantOrm.user_id == user_id))
+        .where(MessageOrm.content_tsv.bool_op("@@")(ts_query))
+        .order_by(rank.desc(), MessageOrm.id.desc())
+        .limit(limit)
+    )
+    if chat_id is not None:
+        matches = matches.where(MessageOrm.chat_id == chat_id)
+    if before is not None:
+        matches = matches.where(tuple_(rank, MessageOrm.id) < tuple_(*before))
+    matches = matches.subquery()
+
+    # Headlines are only built for the page being returned.
+    snippet = func.ts_headline(config, escape_html(matches.c.content), ts_query, SEARCH_HEADLINE_OPTIONS)
+    result = await db.execute(
+        select(matches, snippet.label("snippet"))
+        .order_by(matches.c.rank.desc(), matches.c.id.desc())
+    )
+    return [MessageSearchResult.model_validate(row) for row in result.mappings()]
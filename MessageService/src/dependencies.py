@@ -1,3 +1,5 @@
+import time
+
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer
 
@@ -7,13 +9,16 @@ from models import UserOrm
 
 from schemas import UserInDB
 
-from database import Session
+from database import Session, read_session
 from config import settings
 
 import jwt
 
 oauth2_scheme = HTTPBearer()
 
+user_access_cache: dict[int, tuple[float, int, bool]] = {}
+USER_ACCESS_CACHE_SIZE = 100000
+
 async def get_db():
     async with Session() as session:
         try:
@@ -24,12 +29,57 @@ async def get_db():
             raise
 
 
-async def get_user(username: str) -> UserInDB | None:
+async def get_user(username: str) -> UserOrm | None:
     async with Session() as db:
-        user = await db.scalar(select(UserOrm).filter(UserOrm.username == username))
-        if user:
-            return UserInDB.model_validate(user)
-    return None
+        return await db.scalar(select(UserOrm).filter(UserOrm.username == username))
+
+
+async def user_access(user_id: int) -> tuple[int, bool] | None:
+    entry = user_access_cache.get(user_id)
+    if entry is not None and entry[0] > time.monotonic():
+        return entry[1], entry[2]
+
+    async with Session() as db:
+        row = (await db.execute(
+            select(UserOrm.token_version, UserOrm.disabled).filter(UserOrm.id == user_id)
+        )).first()
+    if row is None:
+        # Not cached: the UserRegistered event may still be on its way.
+        return None
+
+    if len(user_access_cache) >= USER_ACCESS_CACHE_SIZE:
+        user_access_cache.clear()
+    user_access_cache[user_id] = (time.monotonic() + settings.AUTH_ACCESS_CHECK_TTL, row.token_version, row.disabled)
+    return row.token_version, row.disabled
+
+
+async def handle_access_control(event: dict):
+    if event["type"] == "user_access_changed":
+        user_access_cache.pop(event["user_id"], None)
+
+
+def token_allowed(payload: dict, token_version: int, disabled: bool) -> bool:
+    return not disabled and payload.get("ver", 0) >= token_version
+
+
+async def get_user_from_payload(payload: dict) -> UserInDB | None:
+    username = payload.get("sub")
+    user_id = payload.get("uid")
+    if settings.AUTH_MODE != "claims" or not isinstance(user_id, int):
+        user = await get_user(username) # type: ignore
+        if not user or not token_allowed(payload, user.token_version, user.disabled):
+            return None
+        return UserInDB.model_validate(user)
+
+    if settings.AUTH_ACCESS_CHECK_TTL <= 0:
+        # Claims only: the token is trusted until it expires. Open sockets are
+        # still closed when a user_access_changed event arrives.
+        return UserInDB(id=user_id, username=username) # type: ignore
+
+    access = await user_access(user_id)
+    if access is None or not token_allowed(payload, *access):
+        return None
+    return UserInDB(id=user_id, username=username) # type: ignore
 
 
 async def get_current_user(token=Depends(oauth2_scheme)) -> UserInDB:
@@ -50,7 +100,7 @@ async def get_current_user(token=Depends(oauth2_scheme)) -> UserInDB:
         print(a)
         raise credentials_exception
     
-    user = await get_user(username)
+    user = await get_user_from_payload(payload)
     if not user:
         raise credentials_exception
     return user
@@ -66,7 +116,12 @@ async def get_current_user_ws(token: str) -> UserInDB:
     except (jwt.PyJWTError, HTTPException):
         raise Exception("Could not validate credentials")
     
-    user = await get_user(username)
+    user = await get_user_from_payload(payload)
     if not user:
         raise Exception("Could not validate credentials")
     return user
+
+
+async def get_read_db(current_user: UserInDB = Depends(get_current_user)):
+    async with (await read_session(current_user.id))() as session:
+        yield session
@@ -0,0 +1,23 @@
+import hashlib
+
+from fastapi import Request, Response
+
+
+def make_etag(*markers) -> str:
+    digest = hashlib.blake2b(repr(markers).encode(), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Weak comparison: both sides are compared without the W/ prefix.
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag.removeprefix("W/") in tags
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
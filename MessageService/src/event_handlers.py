@@ -1,12 +1,14 @@
 import asyncio
 from aio_pika import connect_robust, ExchangeType
-from aio_pika.abc import AbstractIncomingMessage
+from aio_pika.abc import AbstractChannel, AbstractIncomingMessage
 import json
 
-from sqlalchemy import select
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.dialects.postgresql import insert
 
 from models import UserOrm
 from database import Session
+from ws_manager import ws_manager
 from config import settings
 
 async def add_user_to_db(id: int, username: str):
@@ -23,36 +25,205 @@ async def add_user_to_db(id: int, username: str):
         db.add(profile)
         await db.commit()
 
+async def add_users_to_db(users: dict[int, str]):
+    async with Session() as db:
+        await db.execute(
+            insert(UserOrm)
+            .values([{"id": id, "username": username} for id, username in sorted(users.items())])
+            .on_conflict_do_nothing(index_elements=["id"])
+        )
+        await db.commit()
+
+async def update_users_access(changes: dict[int, tuple[int, bool]]):
+    async with Session() as db:
+        # Events can arrive out of order, so an older token_version never
+        # overwrites a newer one.
+        users = UserOrm.__table__
+        await db.execute(
+            update(users)
+            .where(users.c.id == bindparam("user_id"), users.c.token_version <= bindparam("version"))
+            .values(token_version=bindparam("version"), disabled=bindparam("is_disabled")),
+            [{"user_id": id, "version": version, "is_disabled": disabled}
+             for id, (version, disabled) in sorted(changes.items())]
+        )
+        await db.commit()
+    for id in changes:
+        await ws_manager.publish_control({"type": "user_access_changed", "user_id": id})
+
+def parse_user_registered(message: AbstractIncomingMessage) -> tuple[int, str] | None:
+    event = json.loads(message.body.decode())
+    if event["type"] != "UserRegistered":
+        return None
+    user_data = event["data"]
+    return int(user_data["user_id"]), str(user_data["username"])
+
+def parse_user_access_changed(message: AbstractIncomingMessage) -> tuple[int, int, bool] | None:
+    event = json.loads(message.body.decode())
+    if event["type"] != "UserAccessChanged":
+        return None
+    user_data = event["data"]
+    return int(user_data["user_id"]), int(user_data["token_version"]), bool(user_data["disabled"])
+
 async def handle_user_registered(message: AbstractIncomingMessage):
-    async with message.process():
+    async with message.process(requeue=False):
         try:
-            event = json.loads(message.body.decode())
-            if event["type"] == "UserRegistered":
-                user_data = event["data"]
-                await add_user_to_db(user_data['user_id'], user_data['username'])
+            user = parse_user_registered(message)
+            if user:
+                await add_user_to_db(*user)
+            access = parse_user_access_changed(message)
+            if access:
+                await update_users_access({access[0]: (access[1], access[2])})
                 
         except Exception as e:
             print(f"Error processing message: {e}")
+            raise
+
+
+class UserEventBatcher:
+    def __init__(self, batch_size: int, window: float):
+        self.batch_size = batch_size
+        self.window = window
+        self.queue: asyncio.Queue[AbstractIncomingMessage] = asyncio.Queue()
+        self.batches = 0
+        self.events = 0
+        self.dead_lettered = 0
+
+    async def handle(self, message: AbstractIncomingMessage):
+        self.queue.put_nowait(message)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self.process(batch)
+            except Exception as e:
+                # Usually a closed channel; unacked messages are redelivered.
+                print(f"Error settling user events batch: {e}")
+
+    async def process(self, batch: list[AbstractIncomingMessage]):
+        users: dict[int, str] = {}
+        access_changes: dict[int, tuple[int, bool]] = {}
+        accepted = []
+        for message in batch:
+            try:
+                user = parse_user_registered(message)
+                access = parse_user_access_changed(message)
+            except Exception as e:
+                print(f"Error parsing message: {e}")
+                await self.dead_letter(message)
+                continue
+            if user:
+                users[user[0]] = user[1]
+            if access and access[1] >= access_changes.get(access[0], (-1, False))[0]:
+                access_changes[access[0]] = (access[1], access[2])
+            accepted.append(message)
+
+        if users or access_changes:
+            try:
+                # Registrations go first so a batch can carry both events for a user.
+                if users:
+                    await add_users_to_db(users)
+                if access_changes:
+                    await update_users_access(access_changes)
+            except Exception as e:
+                # One bad row must not fail the whole batch, so retry them one by one.
+                print(f"Error storing user events batch: {e}")
+                accepted = await self.process_one_by_one(accepted)
+
+        if accepted:
+            # Deliveries on a channel are acked in order, so acking the last
+            # one with multiple=True settles the whole batch.
+            await max(accepted, key=lambda message: message.delivery_tag).ack(multiple=True)
+        self.batches += 1
+        self.events += len(batch)
+
+    async def process_one_by_one(self, messages: list[AbstractIncomingMessage]) -> list[AbstractIncomingMessage]:
+        stored = []
+        for message in messages:
+            try:
+                user = parse_user_registered(message)
+                if user:
+                    await add_users_to_db({user[0]: user[1]})
+                access = parse_user_access_changed(message)
+                if access:
+                    await update_users_access({access[0]: (access[1], access[2])})
+            except Exception as e:
+                print(f"Error processing message: {e}")
+                await self.dead_letter(message)
+            else:
+                stored.append(message)
+        return stored
+
+    async def dead_letter(self, message: AbstractIncomingMessage):
+        await message.nack(requeue=False)
+        self.dead_lettered += 1
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "events": self.events,
+            "dead_lettered": self.dead_lettered,
+            "avg_batch_size": self.events / self.batches if self.batches else 0,
+        }
+
+
+user_event_batcher = UserEventBatcher(
+    batch_size=settings.USER_EVENTS_BATCH_SIZE,
+    window=settings.USER_EVENTS_BATCH_WINDOW_MS / 1000
+)
     
 
+DEAD_LETTER_EXCHANGE = "dlx_user_events"
+DEAD_LETTER_QUEUE = "user_events_dead_letter"
+
+
+async def declare_dead_letter_queue(channel: AbstractChannel):
+    exchange = await channel.declare_exchange(
+        name=DEAD_LETTER_EXCHANGE,
+        type=ExchangeType.FANOUT,
+        durable=True)
+    queue = await channel.declare_queue(name=DEAD_LETTER_QUEUE, durable=True)
+    await queue.bind(exchange)
+
+
 async def start_rabbitmq_consumer():
     connection = await connect_robust(host=settings.RABBIT_HOST, login=settings.RABBIT_USER, password=settings.RABBIT_PASS)
     
     async with connection:
         channel = await connection.channel()
+        await channel.set_qos(prefetch_count=settings.USER_EVENTS_PREFETCH)
 
         exchange = await channel.declare_exchange(
         name="user_events",
         type=ExchangeType.FANOUT,
         durable=True)
+        await declare_dead_letter_queue(channel)
 
         queue = await channel.declare_queue(
         name=f"MessagesService_user_events",
         durable=True,
         arguments={
-            "x-dead-letter-exchange": "dlx_user_events"
+            "x-dead-letter-exchange": DEAD_LETTER_EXCHANGE
         })
 
         await queue.bind(exchange)
-        await queue.consume(handle_user_registered) 
-        await asyncio.Future()
+        if settings.USER_EVENTS_CONSUMER == "batch":
+            batcher = asyncio.create_task(user_event_batcher.run())
+            await queue.consume(user_event_batcher.handle)
+        else:
+            await queue.consume(handle_user_registered) 
+        try:
+            await asyncio.Future()
+        finally:
+            if settings.USER_EVENTS_CONSUMER == "batch":
+                batcher.cancel()
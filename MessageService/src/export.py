@@ -0,0 +1,89 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import AsyncIterator
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from config import settings
+from database import Session
+from models import MessageOrm
+from pagination import encode_cursor
+
+EXPORT_COLUMNS = ("id", "seq", "chat_id", "sender_id", "content", "sent_at", "edited", "cursor")
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def export_query(chat_id: int, after: tuple[datetime, int] | None = None):
+    query = (
+        select(
+            MessageOrm.id, MessageOrm.seq, MessageOrm.chat_id, MessageOrm.sender_id,
+            MessageOrm.content, MessageOrm.sent_at, MessageOrm.edited
+        )
+        .where(MessageOrm.chat_id == chat_id)
+        .order_by(MessageOrm.sent_at, MessageOrm.id)
+        .execution_options(yield_per=settings.EXPORT_BATCH_SIZE)
+    )
+    if after is not None:
+        position = tuple_(MessageOrm.sent_at, MessageOrm.id)
+        query = query.where(MessageOrm.sent_at >= after[0], position > tuple_(*after))
+    return query
+
+
+def export_row(row) -> dict:
+    return {
+        "id": row.id,
+        "seq": row.seq,
+        "chat_id": row.chat_id,
+        "sender_id": row.sender_id,
+        "content": row.content,
+        "sent_at": row.sent_at.isoformat(),
+        "edited": row.edited,
+        "cursor": encode_cursor(row.sent_at, row.id),
+    }
+
+
+def format_ndjson(rows) -> str:
+    return "".join(json.dumps(export_row(row), ensure_ascii=False) + "\n" for row in rows)
+
+
+def csv_formatter():
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def format_csv(rows=None) -> str:
+        if rows is None:
+            writer.writerow(EXPORT_COLUMNS)
+        else:
+            writer.writerows(export_row(row).values() for row in rows)
+        chunk = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return chunk
+
+    return format_csv
+
+
+# The export runs on its own session: the request's session is closed
+# before the response body is streamed.
+async def stream_chat_export(
+    chat_id: int,
+    export_format: str = "ndjson",
+    after: tuple[datetime, int] | None = None,
+    session_factory: async_sessionmaker = Session
+) -> AsyncIterator[str]:
+    if export_format == "csv":
+        format_rows = csv_formatter()
+        yield format_rows()
+    else:
+        format_rows = format_ndjson
+
+    async with session_factory() as db:
+        result = await db.stream(export_query(chat_id, after))
+        async for rows in result.partitions():
+            yield format_rows(rows)
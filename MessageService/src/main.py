@@ -1,26 +1,57 @@
 import asyncio
+from datetime import datetime
+from typing import Literal
 
-from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.concurrency import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 
 from sqlalchemy.ext.asyncio import AsyncSession
 import uvicorn
 
 import crud
-from event_handlers import start_rabbitmq_consumer
-from schemas import ChatResponse, ChatCreate, MessageResponse, MessageCreate, UserInDB
-from dependencies import get_current_user, get_current_user_ws, get_db
-from ws_manager import ws_manager
+from event_handlers import start_rabbitmq_consumer, user_event_batcher
+from schemas import (
+    ChatResponse, ChatCreate, ChatListItem, MessageResponse, MessageCreate, MessageSearchResult,
+    ParticipantsChange, ParticipantsUpdate, ReadReceipt, UserInDB
+)
+from dependencies import get_current_user, get_current_user_ws, get_db, get_read_db, handle_access_control
+from database import Session, mark_write, read_session
 from ws_manager import ws_manager
+from ws_protocol import handle_frame, new_message_event, participants_event, replay_chat
+from backplane import create_backplane
+from redis_manager import init_redis
+from message_writer import message_writer
+from membership_cache import membership_cache
+from recent_messages import recent_messages
+from read_receipts import NOT_A_PARTICIPANT, read_receipts, mark_read
+from partitions import run_partition_maintenance
+from export import EXPORT_MEDIA_TYPES, stream_chat_export
+from config import settings
+from pagination import encode_cursor, decode_cursor
+from etag import etag_matches, make_etag, not_modified
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     asyncio.create_task(start_rabbitmq_consumer())
+    asyncio.create_task(run_partition_maintenance())
+    if settings.REDIS_REQUIRED:
+        await init_redis()
+    ws_manager.add_control_handler(membership_cache.handle_control)
+    ws_manager.add_control_handler(handle_access_control)
+    await ws_manager.start(create_backplane())
+    if settings.MESSAGE_WRITER_ENABLED:
+        await message_writer.start()
+    await read_receipts.start()
 
     yield
 
+    await read_receipts.stop()
+    await message_writer.stop()
+    await ws_manager.stop()
+
 
 app = FastAPI(lifespan=lifespan)
 
@@ -31,14 +62,44 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Before-Cursor", "X-After-Cursor", "ETag"],
 )
 
 
+@app.websocket("/ws")
+async def multiplexed_websocket_endpoint(
+    websocket: WebSocket,
+    token: str
+):
+    try:
+        user = await get_current_user_ws(token)
+    except Exception as e:
+        await websocket.close(code=1008, reason="Authentication failed")
+        return
+
+    await websocket.accept()
+
+    connection = await ws_manager.connect(user.id, websocket)
+    async with Session() as db:
+        chat_ids = await crud.get_user_chat_ids(db, user.id)
+    for chat_id in chat_ids:
+        await ws_manager.subscribe(connection, chat_id)
+
+    try:
+        while True:
+            await handle_frame(connection, user, await websocket.receive_text())
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        await ws_manager.disconnect(user.id, websocket)
+
+
 @app.websocket("/ws/{chat_id}")
 async def websocket_endpoint(
     websocket: WebSocket,
     chat_id: int,
-    token: str
+    token: str,
+    since_seq: int | None = None
 ):
     try:
         user = await get_current_user_ws(token)
@@ -46,37 +107,133 @@ async def websocket_endpoint(
         await websocket.close(code=1008, reason="Authentication failed")
         return
 
+    async with Session() as db:
+        is_member = await membership_cache.is_member(db, chat_id, user.id)
+    if not is_member:
+        await websocket.close(code=1008, reason="You are not a participant of this chat")
+        return
+
     await websocket.accept()
     
-    await ws_manager.connect(user.id, websocket)
-    await ws_manager.subscribe_to_chat(user.id, chat_id)
+    connection = await ws_manager.connect(user.id, websocket)
+    await ws_manager.subscribe(connection, chat_id)
+    if since_seq is not None:
+        await replay_chat(connection, chat_id, since_seq)
     
     try:
         while True:
-            await websocket.receive_text()
-    except WebSocketDisconnect:
-        await ws_manager.unsubscribe_from_chat(user.id, chat_id)
+            await handle_frame(connection, user, await websocket.receive_text(), chat_id)
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
         await ws_manager.disconnect(user.id, websocket)
 
 
+@app.get("/metrics")
+async def get_metrics():
+    return {
+        "ws": ws_manager.stats(),
+        "message_writer": message_writer.stats(),
+        "membership_cache": membership_cache.stats(),
+        "recent_messages": recent_messages.stats(),
+        "read_receipts": read_receipts.stats(),
+        "user_events": user_event_batcher.stats(),
+    }
+
+
 @app.post("/chats/", response_model=ChatResponse)
 async def create_chat(
     chat: ChatCreate,
     current_user: UserInDB = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    if current_user.id not in chat.users_ids:
-        chat.users_ids.append(current_user.id)
-    
-    return await crud.create_chat(db, chat)
+    created = await crud.create_chat(db, chat, current_user.id)
+    await db.commit()
+    await membership_cache.invalidate(created.id)
+    return created
 
 
-@app.get("/chats/", response_model=list[ChatResponse])
-async def get_user_chats(
+@app.post("/chats/{chat_id}/participants", response_model=ParticipantsChange)
+async def add_participants(
+    chat_id: int,
+    update: ParticipantsUpdate,
     current_user: UserInDB = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    return await crud.get_user_chats(db, current_user.id)
+    if not await membership_cache.is_member(db, chat_id, current_user.id):
+        raise HTTPException(
+            status_code=403,
+            detail="You are not a participant of this chat"
+        )
+    if not await crud.is_group_chat(db, chat_id):
+        raise HTTPException(
+            status_code=400,
+            detail="Participants can only be changed in group chats"
+        )
+
+    change = await crud.add_participants(db, chat_id, update.users_ids)
+    await db.commit()
+    await membership_cache.invalidate(chat_id)
+    await mark_write(current_user.id)
+
+    if change.added:
+        await ws_manager.broadcast_to_chat(chat_id, participants_event("participants_added", chat_id, change.added))
+    return change
+
+
+@app.delete("/chats/{chat_id}/participants", response_model=ParticipantsChange)
+async def remove_participants(
+    chat_id: int,
+    update: ParticipantsUpdate,
+    current_user: UserInDB = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    if not await membership_cache.is_member(db, chat_id, current_user.id):
+        raise HTTPException(
+            status_code=403,
+            detail="You are not a participant of this chat"
+        )
+    if not await crud.is_group_chat(db, chat_id):
+        raise HTTPException(
+            status_code=400,
+            detail="Participants can only be changed in group chats"
+        )
+
+    change = await crud.remove_participants(db, chat_id, update.users_ids)
+    await db.commit()
+    await membership_cache.invalidate(chat_id)
+    await mark_write(current_user.id)
+
+    if change.removed:
+        await ws_manager.broadcast_to_chat(chat_id, participants_event("participants_removed", chat_id, change.removed))
+        await ws_manager.publish_control({"type": "participants_removed", "chat_id": chat_id, "user_ids": change.removed})
+    return change
+
+
+@app.get("/chats/", response_model=list[ChatListItem])
+async def get_user_chats(
+    request: Request,
+    limit: int | None = None,
+    before: str | None = None,
+    current_user: UserInDB = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    try:
+        before_key = decode_cursor(before, datetime, int) if before else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    version = await crud.get_user_chats_version(db, current_user.id)
+    etag = make_etag("chats", current_user.id, limit, before, *version)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    chats = await crud.get_user_chats(db, current_user.id, limit, before_key)
+    headers = {"ETag": etag}
+    if chats:
+        last_chat, last_activity_at = chats[-1]
+        headers["X-Before-Cursor"] = encode_cursor(last_activity_at, last_chat["id"])
+    return ORJSONResponse([chat for chat, _ in chats], headers=headers)
 
 
 @app.post("/messages/", response_model=MessageResponse)
@@ -93,36 +250,124 @@ async def send_message(
             detail="You are not a participant of this chat"
         )
     
-    ws_message = {
-        "type": "new_message",
-        "data": {
-            "id": message.id,
-            "chat_id": message.chat_id,
-            "sender_id": message.sender_id,
-            "content": message.content,
-            "sent_at": message.sent_at.isoformat()
-        }
-    }
-    await ws_manager.broadcast_to_chat(message.chat_id, ws_message)
+    await db.commit()
+    await recent_messages.add(message)
+    await ws_manager.broadcast_to_chat(message.chat_id, new_message_event(message))
 
     return message
 
 
+@app.get("/messages/search", response_model=list[MessageSearchResult])
+async def search_messages(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=256),
+    chat_id: int | None = None,
+    limit: int = Query(20, ge=1, le=100),
+    before: str | None = None,
+    current_user: UserInDB = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    try:
+        before_key = decode_cursor(before, float, int) if before else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    results = await crud.search_messages(db, current_user.id, q, chat_id, limit, before_key)
+    if results:
+        response.headers["X-Before-Cursor"] = encode_cursor(results[-1].rank, results[-1].id)
+    return results
+
+
 @app.get("/chats/{chat_id}/messages", response_model=list[MessageResponse])
 async def get_messages(
     chat_id: int,
+    request: Request,
     skip: int = 0,
     limit: int = 100,
+    before: str | None = None,
+    after: str | None = None,
     current_user: UserInDB = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
-    messages = await crud.get_chat_messages(db, chat_id, current_user.id, skip, limit)
+    if before and after:
+        raise HTTPException(
+            status_code=400,
+            detail="Only one of 'before' and 'after' can be set"
+        )
+    try:
+        before_key = decode_cursor(before, datetime, int) if before else None
+        after_key = decode_cursor(after, datetime, int) if after else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    # Only the first page is revalidated: it is what clients poll, and older
+    # pages are addressed by cursors. Its version is the chat's last seq.
+    first_page = skip == 0 and before is None and after is None
+    if first_page and request.headers.get("if-none-match"):
+        if not await membership_cache.is_member(db, chat_id, current_user.id):
+            raise HTTPException(
+                status_code=403,
+                detail="You are not a participant of this chat"
+            )
+        etag = make_etag("messages", chat_id, limit, await crud.get_chat_last_seq(db, chat_id))
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+    messages = await crud.get_chat_messages(db, chat_id, current_user.id, skip, limit, before_key, after_key)
     if messages is None:
         raise HTTPException(
             status_code=403,
             detail="You are not a participant of this chat"
         )
-    return messages
+    
+    headers = {}
+    if messages:
+        headers["X-Before-Cursor"] = encode_cursor(messages[-1]["sent_at"], messages[-1]["id"])
+        headers["X-After-Cursor"] = encode_cursor(messages[0]["sent_at"], messages[0]["id"])
+    if first_page:
+        headers["ETag"] = make_etag("messages", chat_id, limit, messages[0]["seq"] if messages else 0)
+    return ORJSONResponse(messages, headers=headers)
+
+
+@app.get("/chats/{chat_id}/export")
+async def export_chat(
+    chat_id: int,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    after: str | None = None,
+    current_user: UserInDB = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    try:
+        after_key = decode_cursor(after, datetime, int) if after else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    if not await membership_cache.is_member(db, chat_id, current_user.id):
+        raise HTTPException(
+            status_code=403,
+            detail="You are not a participant of this chat"
+        )
+
+    return StreamingResponse(
+        stream_chat_export(chat_id, format, after_key, await read_session(current_user.id)),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="chat-{chat_id}.{format}"'}
+    )
+
+
+@app.post("/chats/{chat_id}/read", status_code=204)
+async def mark_chat_read(
+    chat_id: int,
+    receipt: ReadReceipt,
+    current_user: UserInDB = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    error = await mark_read(db, chat_id, current_user.id, receipt.message_id)
+    if error is not None:
+        raise HTTPException(
+            status_code=403 if error == NOT_A_PARTICIPANT else 404,
+            detail=error
+        )
 
 
 if __name__ == "__main__":
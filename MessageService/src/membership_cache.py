@@ -0,0 +1,138 @@
+import time
+from collections import OrderedDict
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from models import ParticipantOrm
+from redis_manager import get_redis
+from database import Session
+from ws_manager import ws_manager
+
+# Rebuilds the member set only if no invalidation bumped the chat's
+# generation since the rebuild started, and replaces whatever set another
+# worker may have written in between.
+STORE_MEMBERS_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+redis.call('SADD', KEYS[1], unpack(ARGV, 3))
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+
+class MembershipCache:
+    key_prefix = "chat_members:"
+    generation_prefix = "chat_members_gen:"
+
+    def __init__(self, max_chats: int, ttl: float, use_redis: bool, redis_ttl: int):
+        self.max_chats = max_chats
+        self.ttl = ttl
+        self.use_redis = use_redis
+        self.redis_ttl = redis_ttl
+        self.entries: OrderedDict[int, tuple[float, frozenset[int]]] = OrderedDict()
+        self.invalidations = 0
+        self.store_script = None
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def key(self, chat_id: int) -> str:
+        return f"{self.key_prefix}{chat_id}"
+
+    def generation_key(self, chat_id: int) -> str:
+        return f"{self.generation_prefix}{chat_id}"
+
+    async def is_member(self, db: AsyncSession, chat_id: int, user_id: int) -> bool:
+        return user_id in await self.get_members(db, chat_id)
+
+    async def get_members(self, db: AsyncSession, chat_id: int) -> frozenset[int]:
+        entry = self.entries.get(chat_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self.entries.move_to_end(chat_id)
+            self.hits += 1
+            return entry[1]
+
+        if self.use_redis:
+            cached = await get_redis().smembers(self.key(chat_id)) # type: ignore
+            if cached:
+                self.redis_hits += 1
+                members = frozenset(int(member) for member in cached)
+                self.store(chat_id, members)
+                return members
+
+        self.misses += 1
+        invalidations = self.invalidations
+        generation = b"0"
+        if self.use_redis:
+            generation = await get_redis().get(self.generation_key(chat_id)) or b"0" # type: ignore
+
+        query = select(ParticipantOrm.user_id).where(ParticipantOrm.chat_id == chat_id)
+        # A lagging replica could put a stale member list back right after an
+        # invalidation, so misses always read from the primary.
+        if db.info.get("replica"):
+            async with Session() as primary:
+                members = frozenset(await primary.scalars(query))
+        else:
+            members = frozenset(await db.scalars(query))
+
+        # An invalidation during the read means the list may already be stale;
+        # return it to this caller but do not cache it.
+        if invalidations == self.invalidations:
+            self.store(chat_id, members)
+        if self.use_redis and members:
+            if self.store_script is None:
+                self.store_script = get_redis().register_script(STORE_MEMBERS_SCRIPT) # type: ignore
+            await self.store_script( # type: ignore
+                keys=[self.key(chat_id), self.generation_key(chat_id)],
+                args=[generation, self.redis_ttl, *members]
+            )
+        return members
+
+    def store(self, chat_id: int, members: frozenset[int]):
+        self.entries[chat_id] = (time.monotonic() + self.ttl, members)
+        self.entries.move_to_end(chat_id)
+        while len(self.entries) > self.max_chats:
+            self.entries.popitem(last=False)
+
+    def forget(self, chat_id: int):
+        self.invalidations += 1
+        self.entries.pop(chat_id, None)
+
+    # Must run after the membership change is committed, otherwise a miss
+    # could cache the old member list again.
+    async def invalidate(self, chat_id: int):
+        self.forget(chat_id)
+        if self.use_redis:
+            async with get_redis().pipeline(transaction=True) as pipe: # type: ignore
+                pipe.incr(self.generation_key(chat_id))
+                pipe.expire(self.generation_key(chat_id), self.redis_ttl)
+                pipe.delete(self.key(chat_id))
+                await pipe.execute()
+        # Other workers keep their own in-process entries.
+        await ws_manager.publish_control({"type": "membership_changed", "chat_id": chat_id})
+
+    async def handle_control(self, event: dict):
+        if event["type"] == "membership_changed":
+            self.forget(event["chat_id"])
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.redis_hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.redis_hits) / lookups if lookups else 0,
+        }
+
+
+membership_cache = MembershipCache(
+    max_chats=settings.MEMBERSHIP_CACHE_SIZE,
+    ttl=settings.MEMBERSHIP_CACHE_TTL,
+    use_redis=settings.MEMBERSHIP_CACHE_REDIS,
+    redis_ttl=settings.MEMBERSHIP_CACHE_REDIS_TTL
+)
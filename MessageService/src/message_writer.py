@@ -0,0 +1,151 @@
+import asyncio
+from collections import Counter
+
+from sqlalchemy import insert, or_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from database import Session
+from models import ChatOrm, MessageOrm
+from schemas import MessageCreate, MessageResponse
+
+
+async def reserve_seqs(db: AsyncSession, counts: dict[int, int]) -> dict[int, int]:
+    first_seqs = {}
+    for chat_id in sorted(counts):
+        last_seq = await db.scalar(
+            update(ChatOrm)
+            .where(ChatOrm.id == chat_id)
+            .values(last_seq=ChatOrm.last_seq + counts[chat_id])
+            .returning(ChatOrm.last_seq)
+        )
+        if last_seq is None:
+            raise ValueError(f"Chat {chat_id} does not exist")
+        first_seqs[chat_id] = last_seq - counts[chat_id] + 1
+    return first_seqs
+
+
+async def record_last_messages(db: AsyncSession, messages: list[MessageResponse]):
+    latest: dict[int, MessageResponse] = {}
+    for message in messages:
+        current = latest.get(message.chat_id)
+        if current is None or message.id > current.id:
+            latest[message.chat_id] = message
+
+    for chat_id in sorted(latest):
+        message = latest[chat_id]
+        await db.execute(
+            update(ChatOrm)
+            .where(
+                ChatOrm.id == chat_id,
+                or_(ChatOrm.last_message_id.is_(None), ChatOrm.last_message_id < message.id)
+            )
+            .values(last_message_id=message.id, last_message_at=message.sent_at)
+        )
+
+
+class MessageWriter:
+    def __init__(self, batch_size: int, window: float):
+        self.batch_size = batch_size
+        self.window = window
+        self.queue: asyncio.Queue[tuple[dict, asyncio.Future] | None] = asyncio.Queue()
+        self.task: asyncio.Task | None = None
+        self.batches = 0
+        self.rows = 0
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None
+
+    async def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.queue.put_nowait(None)
+        await self.task
+        self.task = None
+
+    async def submit(self, message: MessageCreate, sender_id: int) -> MessageResponse:
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait(({**message.model_dump(), "sender_id": sender_id}, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.window
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self.write(batch)
+
+    async def write(self, batch: list[tuple[dict, asyncio.Future]]):
+        try:
+            messages = await self.insert([row for row, _ in batch])
+        except Exception:
+            # One bad row must not fail the whole batch, so retry them one by one.
+            for row, future in batch:
+                try:
+                    [message] = await self.insert([row])
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(message)
+            return
+
+        for (_, future), message in zip(batch, messages):
+            if not future.done():
+                future.set_result(message)
+
+    async def insert(self, rows: list[dict]) -> list[MessageResponse]:
+        async with Session() as db:
+            next_seqs = await reserve_seqs(db, Counter(row["chat_id"] for row in rows))
+            for row in rows:
+                row["seq"] = next_seqs[row["chat_id"]]
+                next_seqs[row["chat_id"]] += 1
+
+            result = await db.scalars(
+                insert(MessageOrm).returning(MessageOrm, sort_by_parameter_order=True),
+                rows
+            )
+            messages = [MessageResponse.model_validate(message) for message in result]
+            await record_last_messages(db, messages)
+            await db.commit()
+
+        self.batches += 1
+        self.rows += len(rows)
+        return messages
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "queued": self.queue.qsize(),
+            "batches": self.batches,
+            "rows": self.rows,
+            "avg_batch_size": self.rows / self.batches if self.batches else 0,
+        }
+
+
+message_writer = MessageWriter(
+    batch_size=settings.MESSAGE_WRITER_BATCH_SIZE,
+    window=settings.MESSAGE_WRITER_WINDOW_MS / 1000
+)
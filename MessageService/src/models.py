@@ -2,7 +2,8 @@ import datetime
 
 from typing import Annotated
 
-from sqlalchemy import String, ForeignKey, text
+from sqlalchemy import BigInteger, Computed, String, ForeignKey, Index, text
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 from database import Base
 
@@ -21,6 +22,9 @@ class ChatOrm(Base):
     is_group: Mapped[bool] = mapped_column(default=False)
     title: Mapped[str] = mapped_column(String(100))
     created_at: Mapped[created_at]
+    last_message_id: Mapped[int | None]
+    last_message_at: Mapped[datetime.datetime | None]
+    last_seq: Mapped[int] = mapped_column(BigInteger, server_default="0")
     
     messages: Mapped[list["MessageOrm"]] = relationship(back_populates="chat")
     users: Mapped[list["UserOrm"]] = relationship(back_populates="chats", secondary="participants")
@@ -28,22 +32,38 @@ class ChatOrm(Base):
 
 class ParticipantOrm(Base):
     __tablename__ = "participants"
+    __table_args__ = (
+        Index("ix_participants_user_id", "user_id"),
+    )
     
     chat_id: Mapped[int] = mapped_column(ForeignKey("chats.id", ondelete="CASCADE"), primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
     joined_at: Mapped[created_at]
+    last_read_message_id: Mapped[int | None]
 
 
+# The messages table is partitioned by sent_at or chat_id (see migration
+# 458c77507a1f), so its real primary key also includes the partition key.
 class MessageOrm(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        Index("ix_messages_chat_id_sent_at_id", "chat_id", "sent_at", "id"),
+        Index("ix_messages_chat_id_id", "chat_id", "id"),
+        Index("ix_messages_chat_id_seq", "chat_id", "seq"),
+        Index("ix_messages_content_tsv", "content_tsv", postgresql_using="gin"),
+    )
     
     id: Mapped[intpk]
     chat_id: Mapped[int] = mapped_column(ForeignKey("chats.id", ondelete="CASCADE"))
     sender_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    seq: Mapped[int] = mapped_column(BigInteger)
     content: Mapped[str] = mapped_column(nullable=False)
     sent_at: Mapped[created_at]
     edited_at: Mapped[updated_at]
     edited: Mapped[bool] = mapped_column(default=False)
+    content_tsv: Mapped[str | None] = mapped_column(
+        TSVECTOR, Computed("to_tsvector('simple', content)", persisted=True), deferred=True
+    )
     
     chat: Mapped["ChatOrm"] = relationship(back_populates="messages")
     sender: Mapped["UserOrm"] = relationship()
@@ -54,5 +74,8 @@ class UserOrm(Base):
  
     id: Mapped[intpk]
     username: Mapped[str]
+    # Mirrored from AuthService UserAccessChanged events.
+    token_version: Mapped[int] = mapped_column(default=0, server_default="0")
+    disabled: Mapped[bool] = mapped_column(default=False, server_default="false")
 
     chats: Mapped[list["ChatOrm"]] = relationship(back_populates="users", secondary="participants")
\ No newline at end of file
@@ -0,0 +1,32 @@
+import base64
+import json
+from datetime import datetime
+
+
+def encode_cursor(*values) -> str:
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_datetime(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value)
+    # Timestamp columns are naive UTC; an aware value cannot be compared
+    # with them.
+    if parsed.tzinfo is not None:
+        raise ValueError
+    return parsed
+
+
+def decode_cursor(cursor: str, *types: type) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        if not isinstance(payload, list) or len(payload) != len(types):
+            raise ValueError
+        return tuple(
+            decode_datetime(value) if type_ is datetime else type_(value)
+            for type_, value in zip(types, payload)
+        )
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
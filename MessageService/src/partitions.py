@@ -0,0 +1,177 @@
+import asyncio
+import datetime
+import re
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from config import settings
+from database import async_engine
+
+PARTITION_NAME = re.compile(r"^messages_p(\d{4})_(\d{2})$")
+DEFAULT_PARTITION = "messages_default"
+# Marks tables detached by apply_retention, so tables an operator detached
+# by hand are never dropped.
+DETACHED_COMMENT = "detached by messages retention"
+MAINTENANCE_LOCK_ID = 0x6D736770
+
+
+def add_months(month: datetime.date, months: int) -> datetime.date:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def month_partition_name(month: datetime.date) -> str:
+    return f"messages_p{month.year:04d}_{month.month:02d}"
+
+
+async def get_partition_strategy(conn: AsyncConnection) -> str | None:
+    return await conn.scalar(text("""
+        SELECT partstrat::text
+        FROM pg_partitioned_table
+        WHERE partrelid = to_regclass('messages')
+    """))
+
+
+async def get_month_partitions(conn: AsyncConnection) -> dict[datetime.date, str]:
+    names = await conn.scalars(text("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = 'messages'::regclass
+    """))
+    partitions = {}
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions[datetime.date(int(match[1]), int(match[2]), 1)] = name
+    return partitions
+
+
+async def get_detached_partitions(conn: AsyncConnection) -> dict[datetime.date, str]:
+    names = await conn.scalars(text("""
+        SELECT relname
+        FROM pg_class
+        WHERE relkind = 'r'
+          AND NOT relispartition
+          AND relname LIKE 'messages\\_p%'
+          AND pg_table_is_visible(oid)
+          AND obj_description(oid, 'pg_class') = :comment
+    """), {"comment": DETACHED_COMMENT})
+    partitions = {}
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions[datetime.date(int(match[1]), int(match[2]), 1)] = name
+    return partitions
+
+
+async def default_partition_has_rows(conn: AsyncConnection, start: datetime.date, end: datetime.date) -> bool:
+    if not await conn.scalar(text(f"SELECT to_regclass('{DEFAULT_PARTITION}') IS NOT NULL")):
+        return False
+    return await conn.scalar(text(
+        f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE sent_at >= :start AND sent_at < :end)"
+    ), {"start": start, "end": end})
+
+
+async def create_month_partition(conn: AsyncConnection, month: datetime.date):
+    name = month_partition_name(month)
+    start, end = month, add_months(month, 1)
+    bounds = f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    if not await default_partition_has_rows(conn, start, end):
+        await conn.execute(text(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF messages {bounds}"))
+        return
+
+    # Postgres refuses to add a partition while rows for its range sit in the
+    # DEFAULT partition, so move them into the new table before attaching it.
+    columns = ", ".join(f'"{column}"' for column in await conn.scalars(text("""
+        SELECT attname
+        FROM pg_attribute
+        WHERE attrelid = 'messages'::regclass AND attnum > 0 AND NOT attisdropped AND attgenerated = ''
+        ORDER BY attnum
+    """)))
+    await conn.execute(text(f"CREATE TABLE {name} (LIKE messages INCLUDING ALL)"))
+    await conn.execute(text(f"""
+        WITH moved AS (
+            DELETE FROM {DEFAULT_PARTITION}
+            WHERE sent_at >= :start AND sent_at < :end
+            RETURNING {columns}
+        )
+        INSERT INTO {name} ({columns}) SELECT {columns} FROM moved
+    """), {"start": start, "end": end})
+    await conn.execute(text(f"ALTER TABLE messages ATTACH PARTITION {name} {bounds}"))
+
+
+async def ensure_month_partitions(conn: AsyncConnection, today: datetime.date) -> list[str]:
+    existing = await get_month_partitions(conn)
+    current = today.replace(day=1)
+    created = []
+    for offset in range(settings.MESSAGES_PARTITION_PREMAKE_MONTHS + 1):
+        month = add_months(current, offset)
+        if month in existing:
+            continue
+        await create_month_partition(conn, month)
+        created.append(month_partition_name(month))
+    return created
+
+
+async def apply_retention(conn: AsyncConnection, today: datetime.date) -> list[str]:
+    if settings.MESSAGES_RETENTION_MONTHS <= 0:
+        return []
+
+    cutoff = add_months(today.replace(day=1), -settings.MESSAGES_RETENTION_MONTHS)
+    expired = []
+    for month, name in sorted((await get_month_partitions(conn)).items()):
+        if add_months(month, 1) > cutoff:
+            continue
+        if settings.MESSAGES_RETENTION_MODE == "drop":
+            await conn.execute(text(f"DROP TABLE {name}"))
+        else:
+            await conn.execute(text(f"ALTER TABLE messages DETACH PARTITION {name}"))
+            await conn.execute(text(f"COMMENT ON TABLE {name} IS '{DETACHED_COMMENT}'"))
+        expired.append(name)
+    return expired
+
+
+async def drop_detached_partitions(conn: AsyncConnection, today: datetime.date) -> list[str]:
+    if settings.MESSAGES_RETENTION_MONTHS <= 0 or settings.MESSAGES_DETACHED_RETENTION_MONTHS <= 0:
+        return []
+
+    # Opt-in: detached partitions are kept for MESSAGES_DETACHED_RETENTION_MONTHS
+    # so they can be archived (pg_dump -t) or reattached, then dropped.
+    cutoff = add_months(
+        today.replace(day=1),
+        -(settings.MESSAGES_RETENTION_MONTHS + settings.MESSAGES_DETACHED_RETENTION_MONTHS)
+    )
+    dropped = []
+    for month, name in sorted((await get_detached_partitions(conn)).items()):
+        if add_months(month, 1) > cutoff:
+            continue
+        await conn.execute(text(f"DROP TABLE {name}"))
+        dropped.append(name)
+    return dropped
+
+
+async def maintain_partitions(today: datetime.date | None = None) -> dict:
+    today = today or datetime.datetime.now(datetime.timezone.utc).date()
+    async with async_engine.begin() as conn:
+        if await get_partition_strategy(conn) != "r":
+            return {"created": [], "expired": [], "dropped": []}
+        if not await conn.scalar(text("SELECT pg_try_advisory_xact_lock(:id)"), {"id": MAINTENANCE_LOCK_ID}):
+            return {"created": [], "expired": [], "dropped": []}
+        return {
+            "created": await ensure_month_partitions(conn, today),
+            "expired": await apply_retention(conn, today),
+            "dropped": await drop_detached_partitions(conn, today),
+        }
+
+
+async def run_partition_maintenance():
+    while True:
+        try:
+            result = await maintain_partitions()
+            if result["created"] or result["expired"] or result["dropped"]:
+                print(f"Messages partition maintenance: {result}")
+        except Exception as e:
+            print(f"Error maintaining message partitions: {e}")
+        await asyncio.sleep(settings.MESSAGES_PARTITION_MAINTENANCE_INTERVAL)
@@ -0,0 +1,176 @@
+import asyncio
+from collections import OrderedDict
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import crud
+from config import settings
+from database import Session, mark_write
+from membership_cache import membership_cache
+from ws_manager import ws_manager
+
+FLUSH_READ_POINTERS = text("""
+    UPDATE participants AS p
+    SET last_read_message_id = v.message_id
+    FROM unnest(
+        CAST(:chat_ids AS integer[]),
+        CAST(:user_ids AS integer[]),
+        CAST(:message_ids AS integer[])
+    ) AS v(chat_id, user_id, message_id)
+    WHERE p.chat_id = v.chat_id
+      AND p.user_id = v.user_id
+      AND (p.last_read_message_id IS NULL OR p.last_read_message_id < v.message_id)
+""")
+
+
+NOT_A_PARTICIPANT = "You are not a participant of this chat"
+UNKNOWN_MESSAGE = "Message not found in this chat"
+
+
+class ReadReceiptBuffer:
+    def __init__(self, flush_interval: float, max_pending: int, known_size: int, max_retries: int):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.known_size = known_size
+        self.max_retries = max_retries
+        self.failed_flushes = 0
+        self.pending: dict[tuple[int, int], int] = {}
+        self.known: OrderedDict[tuple[int, int], int] = OrderedDict()
+        self.wakeup = asyncio.Event()
+        self.task: asyncio.Task | None = None
+        self.marks = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.dropped_rows = 0
+
+    async def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            # A flush interrupted by the cancel puts its batch back before
+            # the task finishes, so the final flush below still writes it.
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush()
+
+    def is_newer(self, chat_id: int, user_id: int, message_id: int) -> bool:
+        current = self.known.get((chat_id, user_id))
+        return current is None or current < message_id
+
+    def mark(self, chat_id: int, user_id: int, message_id: int) -> bool:
+        key = (chat_id, user_id)
+        if not self.is_newer(chat_id, user_id, message_id):
+            return False
+
+        self.marks += 1
+        self.known[key] = message_id
+        self.known.move_to_end(key)
+        while len(self.known) > self.known_size:
+            self.known.popitem(last=False)
+
+        self.pending[key] = max(message_id, self.pending.get(key, 0))
+        if len(self.pending) >= self.max_pending:
+            self.wakeup.set()
+        return True
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error flushing read receipts: {e}")
+
+    async def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+        try:
+            await self.write(batch)
+        except asyncio.CancelledError:
+            self.requeue(batch)
+            raise
+        except Exception as e:
+            self.failed_flushes += 1
+            if self.failed_flushes < self.max_retries:
+                self.requeue(batch)
+                raise
+            # The same batch keeps failing, most likely because of one bad
+            # row; write rows one by one and drop the ones that still fail.
+            print(f"Error flushing read receipts, retrying rows one by one: {e}")
+            await self.write_one_by_one(batch)
+        self.failed_flushes = 0
+        self.flushes += 1
+
+    async def write(self, batch: dict[tuple[int, int], int]):
+        async with Session() as db:
+            await db.execute(FLUSH_READ_POINTERS, {
+                "chat_ids": [chat_id for chat_id, _ in batch],
+                "user_ids": [user_id for _, user_id in batch],
+                "message_ids": list(batch.values()),
+            })
+            await db.commit()
+        self.flushed_rows += len(batch)
+
+    async def write_one_by_one(self, batch: dict[tuple[int, int], int]):
+        for key, message_id in batch.items():
+            try:
+                await self.write({key: message_id})
+            except Exception as e:
+                print(f"Dropping read receipt {key} -> {message_id}: {e}")
+                self.known.pop(key, None)
+                self.dropped_rows += 1
+
+    def requeue(self, batch: dict[tuple[int, int], int]):
+        for key, message_id in batch.items():
+            self.pending[key] = max(message_id, self.pending.get(key, 0))
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self.pending),
+            "marks": self.marks,
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+            "dropped_rows": self.dropped_rows,
+            "failed_flushes": self.failed_flushes,
+        }
+
+
+read_receipts = ReadReceiptBuffer(
+    flush_interval=settings.READ_RECEIPTS_FLUSH_INTERVAL,
+    max_pending=settings.READ_RECEIPTS_MAX_PENDING,
+    known_size=settings.READ_RECEIPTS_KNOWN_SIZE,
+    max_retries=settings.READ_RECEIPTS_MAX_RETRIES
+)
+
+
+def read_event(chat_id: int, user_id: int, message_id: int) -> dict:
+    return {
+        "type": "read",
+        "chat_id": chat_id,
+        "data": {"user_id": user_id, "message_id": message_id}
+    }
+
+
+async def mark_read(db: AsyncSession, chat_id: int, user_id: int, message_id: int) -> str | None:
+    if not await membership_cache.is_member(db, chat_id, user_id):
+        return NOT_A_PARTICIPANT
+    if not read_receipts.is_newer(chat_id, user_id, message_id):
+        return None
+    if not await crud.message_in_chat(db, chat_id, message_id):
+        return UNKNOWN_MESSAGE
+    if read_receipts.mark(chat_id, user_id, message_id):
+        await mark_write(user_id)
+        await ws_manager.broadcast_to_chat(chat_id, read_event(chat_id, user_id, message_id))
+    return None
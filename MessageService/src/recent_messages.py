@@ -0,0 +1,122 @@
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import orjson
+
+from config import settings
+from redis_manager import get_redis
+from schemas import MessageResponse
+
+
+def contiguous_newest(entries: list[tuple[int, dict]]) -> list[tuple[int, dict]]:
+    # Seqs are dense per chat, so a gap means a message was missed and only
+    # the run ending at the newest message can be trusted.
+    for index in range(1, len(entries)):
+        if entries[index][0] != entries[index - 1][0] - 1:
+            return entries[:index]
+    return entries
+
+
+class RecentMessagesCache:
+    key_prefix = "chat_recent:"
+
+    def __init__(self, max_chats: int, size: int, ttl: float, use_redis: bool, redis_ttl: int):
+        self.max_chats = max_chats
+        self.size = size
+        self.ttl = ttl
+        self.use_redis = use_redis
+        self.redis_ttl = redis_ttl
+        self.entries: OrderedDict[int, tuple[float, list[tuple[int, dict]]]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, chat_id: int) -> str:
+        return f"{self.key_prefix}{chat_id}"
+
+    async def get(self, chat_id: int, limit: int) -> list[dict] | None:
+        entries = await self.load(chat_id, limit)
+        # An entry that reaches seq 1 holds the whole chat.
+        if entries and (len(entries) >= limit or entries[-1][0] == 1):
+            self.hits += 1
+            return [message for _, message in entries[:limit]]
+        self.misses += 1
+        return None
+
+    async def load(self, chat_id: int, limit: int) -> list[tuple[int, dict]]:
+        if self.use_redis:
+            try:
+                cached = await get_redis().zrevrange(self.key(chat_id), 0, limit - 1, withscores=True) # type: ignore
+            except Exception as e:
+                print(f"Error reading recent messages of chat {chat_id}: {e}")
+                return []
+            entries = []
+            for data, seq in cached:
+                message = orjson.loads(data)
+                message["sent_at"] = datetime.fromisoformat(message["sent_at"])
+                entries.append((int(seq), message))
+            return contiguous_newest(entries)
+
+        entry = self.entries.get(chat_id)
+        if entry is None or entry[0] <= time.monotonic():
+            return []
+        self.entries.move_to_end(chat_id)
+        return entry[1]
+
+    async def add(self, message: MessageResponse):
+        await self.store(message.chat_id, [message.model_dump()])
+
+    async def store(self, chat_id: int, messages: list[dict]):
+        if not messages or self.size <= 0:
+            return
+
+        if self.use_redis:
+            # The cache is best-effort: callers store after the message is
+            # committed, so a Redis error must not fail the send.
+            try:
+                async with get_redis().pipeline(transaction=True) as pipe: # type: ignore
+                    pipe.zadd(self.key(chat_id), {orjson.dumps(message): message["seq"] for message in messages})
+                    pipe.zremrangebyrank(self.key(chat_id), 0, -self.size - 1)
+                    pipe.expire(self.key(chat_id), self.redis_ttl)
+                    await pipe.execute()
+            except Exception as e:
+                print(f"Error caching recent messages of chat {chat_id}: {e}")
+                # A missed message would leave a gap that later reads could
+                # serve, so drop the chat's window instead.
+                try:
+                    await get_redis().delete(self.key(chat_id)) # type: ignore
+                except Exception as e:
+                    print(f"Error dropping recent messages of chat {chat_id}: {e}")
+            return
+
+        entry = self.entries.get(chat_id)
+        merged = dict(entry[1]) if entry is not None and entry[0] > time.monotonic() else {}
+        merged.update((message["seq"], message) for message in messages)
+        entries = contiguous_newest(sorted(merged.items(), reverse=True)[:self.size])
+        self.entries[chat_id] = (time.monotonic() + self.ttl, entries)
+        self.entries.move_to_end(chat_id)
+        while len(self.entries) > self.max_chats:
+            self.entries.popitem(last=False)
+
+    async def invalidate(self, chat_id: int):
+        self.entries.pop(chat_id, None)
+        if self.use_redis:
+            await get_redis().delete(self.key(chat_id)) # type: ignore
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0,
+        }
+
+
+recent_messages = RecentMessagesCache(
+    max_chats=settings.RECENT_MESSAGES_CACHE_CHATS,
+    size=settings.RECENT_MESSAGES_CACHE_SIZE,
+    ttl=settings.RECENT_MESSAGES_CACHE_TTL,
+    use_redis=settings.RECENT_MESSAGES_CACHE_REDIS,
+    redis_ttl=settings.RECENT_MESSAGES_CACHE_REDIS_TTL
+)
@@ -1,6 +1,9 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter
 from datetime import datetime
-from typing import List
+from typing import Annotated, List, Literal, Union
+
+# Message ids are int4 in Postgres.
+MessageId = Annotated[int, Field(ge=1, le=2**31 - 1)]
 
 
 class MessageCreate(BaseModel):
@@ -10,6 +13,7 @@ class MessageCreate(BaseModel):
 
 class MessageResponse(MessageCreate):
     id: int
+    seq: int
     sender_id: int
     sent_at: datetime
     edited: bool
@@ -18,6 +22,11 @@ class MessageResponse(MessageCreate):
         from_attributes = True
 
 
+class MessageSearchResult(MessageResponse):
+    rank: float
+    snippet: str
+
+
 class ChatBase(BaseModel):
     is_group: bool = False
     title: str | None = None
@@ -27,6 +36,16 @@ class ChatCreate(ChatBase):
     users_ids: List[int]
 
 
+class ParticipantsUpdate(BaseModel):
+    users_ids: List[int] = Field(..., min_length=1, max_length=10000)
+
+
+class ParticipantsChange(BaseModel):
+    added: List[int] = []
+    removed: List[int] = []
+    missing: List[int] = []
+
+
 class ChatResponse(ChatBase):
     id: int
     created_at: datetime
@@ -35,9 +54,49 @@ class ChatResponse(ChatBase):
         from_attributes = True
 
 
+class ReadReceipt(BaseModel):
+    message_id: MessageId
+
+
+class ChatListItem(ChatResponse):
+    last_message: MessageResponse | None = None
+    unread_count: int = 0
+
+
 class UserInDB(BaseModel):
     id: int
     username: str
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+
+class WsSendFrame(BaseModel):
+    type: Literal["send"]
+    client_id: str = Field(..., min_length=1, max_length=64)
+    chat_id: int | None = None
+    content: str = Field(..., min_length=1, max_length=2000)
+
+
+class WsSubscribeFrame(BaseModel):
+    type: Literal["subscribe"]
+    chat_id: int
+    since_seq: int | None = Field(None, ge=0)
+
+
+class WsUnsubscribeFrame(BaseModel):
+    type: Literal["unsubscribe"]
+    chat_id: int
+
+
+class WsReadFrame(BaseModel):
+    type: Literal["read"]
+    chat_id: int | None = None
+    message_id: MessageId
+
+
+WsClientFrame = Annotated[
+    Union[WsSendFrame, WsSubscribeFrame, WsUnsubscribeFrame, WsReadFrame],
+    Field(discriminator="type")
+]
+ws_client_frame_adapter = TypeAdapter(WsClientFrame)
@@ -1,42 +1,170 @@
+import asyncio
 from collections import defaultdict
 
 import json
 
-from typing import Dict, Set
+from typing import Awaitable, Callable, Dict, Set
 
 from fastapi import WebSocket
 
+from backplane import Backplane, InMemoryBackplane
+from config import settings
+
+SLOW_CONSUMER_CLOSE_CODE = 4000
+POLICY_VIOLATION_CLOSE_CODE = 1008
+
+
+class Connection:
+    def __init__(self, manager: "ConnectionManager", user_id: int, websocket: WebSocket):
+        self.manager = manager
+        self.user_id = user_id
+        self.websocket = websocket
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize=settings.WS_SEND_QUEUE_SIZE)
+        self.chats: Set[int] = set()
+        self.dropped = 0
+        self.closed = False
+        self.close_task: asyncio.Task | None = None
+        self.writer_task = asyncio.create_task(self.writer())
+
+    def send(self, message: str) -> bool:
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            self.manager.dropped_messages += 1
+            if self.close_task is None:
+                self.close_task = asyncio.create_task(
+                    self.close(SLOW_CONSUMER_CLOSE_CODE, "Slow consumer: send queue overflow")
+                )
+            return False
+        return True
+
+    async def writer(self):
+        try:
+            while True:
+                message = await self.queue.get()
+                await asyncio.wait_for(self.websocket.send_text(message), settings.WS_SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            await self.close(SLOW_CONSUMER_CLOSE_CODE, "Slow consumer: send timeout")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            await self.close()
+
+    async def close(self, code: int | None = None, reason: str = ""):
+        if self.closed:
+            return
+        self.closed = True
+        self.dropped += self.queue.qsize()
+        self.manager.dropped_messages += self.queue.qsize()
+        if self.writer_task is not asyncio.current_task():
+            self.writer_task.cancel()
+        await self.manager.disconnect(self.user_id, self.websocket)
+
+        if code is not None:
+            self.manager.evicted_connections += 1
+            try:
+                await asyncio.wait_for(self.websocket.close(code=code, reason=reason), settings.WS_SEND_TIMEOUT)
+            except Exception:
+                pass
+
+
 class ConnectionManager:
-    def __init__(self):
+    def __init__(self, backplane: Backplane | None = None):
         self.active_connections: Dict[int, Set[WebSocket]] = defaultdict(set)
-        self.chat_subscriptions: Dict[int, Set[int]] = defaultdict(set)
+        self.chat_subscriptions: Dict[int, Set[Connection]] = defaultdict(set)
+        self.connections: Dict[WebSocket, Connection] = {}
+        self.backplane = backplane or InMemoryBackplane()
+        self.control_handlers: list[Callable[[dict], Awaitable[None]]] = []
+        self.dropped_messages = 0
+        self.evicted_connections = 0
+
+    async def start(self, backplane: Backplane | None = None):
+        if backplane is not None:
+            self.backplane = backplane
+        await self.backplane.start(self.deliver_to_chat, self.deliver_control)
+        for chat_id in self.chat_subscriptions:
+            await self.backplane.subscribe(chat_id)
 
-    async def connect(self, user_id: int, websocket: WebSocket):
+    async def stop(self):
+        await self.backplane.stop()
+
+    async def connect(self, user_id: int, websocket: WebSocket) -> Connection:
+        connection = Connection(self, user_id, websocket)
+        self.connections[websocket] = connection
         self.active_connections[user_id].add(websocket)
+        return connection
 
     async def disconnect(self, user_id: int, websocket):
-        if websocket in self.active_connections[user_id]:
+        if websocket in self.active_connections.get(user_id, ()):
             self.active_connections[user_id].remove(websocket)
             if not self.active_connections[user_id]:
                 del self.active_connections[user_id]
 
-    async def subscribe_to_chat(self, user_id: int, chat_id: int):
-        self.chat_subscriptions[chat_id].add(user_id)
+        connection = self.connections.pop(websocket, None)
+        if connection is None:
+            return
+        for chat_id in list(connection.chats):
+            await self.unsubscribe(connection, chat_id)
+        await connection.close()
+
+    async def subscribe(self, connection: Connection, chat_id: int):
+        first_subscriber = not self.chat_subscriptions[chat_id]
+        self.chat_subscriptions[chat_id].add(connection)
+        connection.chats.add(chat_id)
+        if first_subscriber:
+            await self.backplane.subscribe(chat_id)
 
-    async def unsubscribe_from_chat(self, user_id: int, chat_id: int):
-        if user_id in self.chat_subscriptions[chat_id]:
-            self.chat_subscriptions[chat_id].remove(user_id)
+    async def unsubscribe(self, connection: Connection, chat_id: int):
+        self.chat_subscriptions[chat_id].discard(connection)
+        connection.chats.discard(chat_id)
+        if not self.chat_subscriptions[chat_id]:
+            del self.chat_subscriptions[chat_id]
+            await self.backplane.unsubscribe(chat_id)
 
     async def broadcast_to_chat(self, chat_id: int, message: dict):
-        message_json = json.dumps(message)
-        users = self.chat_subscriptions.get(chat_id, set())
-        
-        for user_id in users:
-            if user_id in self.active_connections:
-                for websocket in self.active_connections[user_id]:
-                    try:
-                        await websocket.send_text(message_json)
-                    except Exception:
-                        await self.disconnect(user_id, websocket)
-
-ws_manager = ConnectionManager()
\ No newline at end of file
+        await self.backplane.publish(chat_id, json.dumps(message))
+
+    async def deliver_to_chat(self, chat_id: int, message_json: str):
+        for connection in list(self.chat_subscriptions.get(chat_id, ())):
+            connection.send(message_json)
+
+    def add_control_handler(self, handler: Callable[[dict], Awaitable[None]]):
+        self.control_handlers.append(handler)
+
+    async def publish_control(self, event: dict):
+        await self.backplane.publish_control(json.dumps(event))
+
+    async def deliver_control(self, message_json: str):
+        event = json.loads(message_json)
+        if event["type"] == "participants_removed":
+            await self.unsubscribe_users(event["chat_id"], set(event["user_ids"]))
+        elif event["type"] == "user_access_changed":
+            await self.close_user(event["user_id"], POLICY_VIOLATION_CLOSE_CODE, "Access revoked")
+        for handler in self.control_handlers:
+            await handler(event)
+
+    async def unsubscribe_users(self, chat_id: int, user_ids: set[int]):
+        for connection in list(self.chat_subscriptions.get(chat_id, ())):
+            if connection.user_id in user_ids:
+                await self.unsubscribe(connection, chat_id)
+
+    async def close_user(self, user_id: int, code: int, reason: str):
+        for websocket in list(self.active_connections.get(user_id, ())):
+            connection = self.connections.get(websocket)
+            if connection is not None:
+                await connection.close(code, reason)
+
+    def stats(self) -> dict:
+        depths = [connection.queue.qsize() for connection in self.connections.values()]
+        return {
+            "connections": len(depths),
+            "queued_messages": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "dropped_messages": self.dropped_messages,
+            "evicted_connections": self.evicted_connections,
+        }
+
+ws_manager = ConnectionManager()
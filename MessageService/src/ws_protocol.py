@@ -0,0 +1,140 @@
+import json
+
+from pydantic import ValidationError
+
+import crud
+from config import settings
+from database import Session
+from membership_cache import membership_cache
+from read_receipts import mark_read
+from recent_messages import recent_messages
+from schemas import (
+    MessageCreate, MessageResponse, UserInDB,
+    WsSendFrame, WsSubscribeFrame, WsUnsubscribeFrame, WsReadFrame, ws_client_frame_adapter
+)
+from ws_manager import Connection, ws_manager
+
+
+def message_data(message: MessageResponse) -> dict:
+    return {
+        "id": message.id,
+        "seq": message.seq,
+        "chat_id": message.chat_id,
+        "sender_id": message.sender_id,
+        "content": message.content,
+        "sent_at": message.sent_at.isoformat()
+    }
+
+
+def new_message_event(message: MessageResponse) -> dict:
+    return {
+        "type": "new_message",
+        "chat_id": message.chat_id,
+        "data": message_data(message)
+    }
+
+
+def participants_event(event_type: str, chat_id: int, user_ids: list[int]) -> dict:
+    return {
+        "type": event_type,
+        "chat_id": chat_id,
+        "data": {"user_ids": user_ids}
+    }
+
+
+def send_error(connection: Connection, detail: str, client_id: str | None = None, chat_id: int | None = None):
+    connection.send(json.dumps({"type": "error", "chat_id": chat_id, "client_id": client_id, "detail": detail}))
+
+
+async def handle_frame(connection: Connection, user: UserInDB, raw: str, default_chat_id: int | None = None):
+    if raw == "ping":
+        return
+
+    try:
+        frame = ws_client_frame_adapter.validate_json(raw)
+    except ValidationError:
+        send_error(connection, "Invalid frame")
+        return
+
+    if isinstance(frame, WsSendFrame):
+        await handle_send(connection, user, frame, default_chat_id)
+    elif isinstance(frame, WsSubscribeFrame):
+        await handle_subscribe(connection, user, frame)
+    elif isinstance(frame, WsUnsubscribeFrame):
+        await ws_manager.unsubscribe(connection, frame.chat_id)
+        connection.send(json.dumps({"type": "unsubscribed", "chat_id": frame.chat_id}))
+    elif isinstance(frame, WsReadFrame):
+        await handle_read(connection, user, frame, default_chat_id)
+
+
+# Replay is sent after subscribing, so a message broadcast in between can
+# arrive both live and in the replay; clients drop anything at or below the
+# last seq they have seen.
+async def replay_chat(connection: Connection, chat_id: int, since_seq: int):
+    async with Session() as db:
+        messages = await crud.get_messages_since(db, chat_id, since_seq, settings.WS_REPLAY_LIMIT + 1)
+    truncated = len(messages) > settings.WS_REPLAY_LIMIT
+    messages = messages[:settings.WS_REPLAY_LIMIT]
+    connection.send(json.dumps({
+        "type": "replay",
+        "chat_id": chat_id,
+        "data": {
+            "since_seq": since_seq,
+            "messages": [message_data(message) for message in messages],
+            "truncated": truncated
+        }
+    }))
+
+
+async def handle_read(connection: Connection, user: UserInDB, frame: WsReadFrame, default_chat_id: int | None):
+    chat_id = frame.chat_id if frame.chat_id is not None else default_chat_id
+    if chat_id is None:
+        send_error(connection, "chat_id is required")
+        return
+
+    async with Session() as db:
+        error = await mark_read(db, chat_id, user.id, frame.message_id)
+    if error is not None:
+        send_error(connection, error, chat_id=chat_id)
+
+
+async def handle_subscribe(connection: Connection, user: UserInDB, frame: WsSubscribeFrame):
+    async with Session() as db:
+        is_member = await membership_cache.is_member(db, frame.chat_id, user.id)
+    if not is_member:
+        send_error(connection, "You are not a participant of this chat", chat_id=frame.chat_id)
+        return
+
+    await ws_manager.subscribe(connection, frame.chat_id)
+    connection.send(json.dumps({"type": "subscribed", "chat_id": frame.chat_id}))
+    if frame.since_seq is not None:
+        await replay_chat(connection, frame.chat_id, frame.since_seq)
+
+
+async def handle_send(connection: Connection, user: UserInDB, frame: WsSendFrame, default_chat_id: int | None):
+    chat_id = frame.chat_id if frame.chat_id is not None else default_chat_id
+    if chat_id is None:
+        send_error(connection, "chat_id is required", frame.client_id)
+        return
+
+    try:
+        async with Session() as db:
+            message = await crud.create_message(db, MessageCreate(content=frame.content, chat_id=chat_id), user.id)
+            await db.commit()
+    except Exception as e:
+        print(f"Error saving message from websocket: {e}")
+        send_error(connection, "Message could not be saved", frame.client_id, chat_id)
+        return
+
+    if not message:
+        send_error(connection, "You are not a participant of this chat", frame.client_id, chat_id)
+        return
+
+    connection.send(json.dumps({
+        "type": "ack",
+        "chat_id": message.chat_id,
+        "client_id": frame.client_id,
+        "data": message.model_dump(mode="json")
+    }))
+    await recent_messages.add(message)
+    await ws_manager.broadcast_to_chat(message.chat_id, new_message_event(message))
@@ -10,16 +10,39 @@ class Settings(BaseSettings):
     ALGORITHM: str
     PUBLIC_KEY: str
     DB_ENGINE_ECHO: bool
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30
+    DB_POOL_RECYCLE: int = -1
+    DB_POOL_PRE_PING: bool = False
+    DB_STATEMENT_CACHE_SIZE: int = 100
+    DB_PGBOUNCER: bool = False
+    DB_REPLICA_HOST: str | None = None
+    DB_REPLICA_PORT: int | None = None
+    DB_READ_YOUR_WRITES_WINDOW: float = 5.0
     RABBIT_HOST: str
     RABBIT_USER: str
     RABBIT_PASS: str
     REDIS_HOST: str
     REDIS_PASS: str
+    PRESENCE_SEND_TIMEOUT: float = 5.0
+    PRESENCE_SEND_QUEUE_SIZE: int = 100
+    PRESENCE_TIMEOUT: float = 300
+    PRESENCE_HEARTBEAT_INTERVAL: float = 30
+    PRESENCE_FLUSH_WINDOW_MS: int = 50
+    PRESENCE_SWEEP_INTERVAL: float = 5
+    PRESENCE_SWEEP_BATCH_SIZE: int = 500
+    PRESENCE_BULK_LIMIT: int = 500
 
     @property
     def DATABASE_URL_asyncpg(self):
         return f"postgresql+asyncpg://{self.DB_USER}:{self.DB_PASS}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
     
+    @property
+    def DATABASE_URL_asyncpg_replica(self):
+        port = self.DB_REPLICA_PORT or self.DB_PORT
+        return f"postgresql+asyncpg://{self.DB_USER}:{self.DB_PASS}@{self.DB_REPLICA_HOST}:{port}/{self.DB_NAME}"
+    
     @property
     def DATABASE_URL_psycopg(self):
         return f"postgresql+psycopg2://{self.DB_USER}:{self.DB_PASS}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
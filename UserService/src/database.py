@@ -1,12 +1,79 @@
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from uuid import uuid4
+
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import NullPool
+from redis_manager import get_redis
 from config import settings
 
+
+def engine_options() -> dict:
+    if settings.DB_PGBOUNCER:
+        # PgBouncer in transaction mode does the pooling and cannot keep
+        # prepared statements across transactions.
+        return {
+            "echo": settings.DB_ENGINE_ECHO,
+            "poolclass": NullPool,
+            "connect_args": {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+            },
+        }
+    return {
+        "echo": settings.DB_ENGINE_ECHO,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+        "connect_args": {"statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE},
+    }
+
+
 async_engine = create_async_engine(
     url=settings.DATABASE_URL_asyncpg,
-    echo=settings.DB_ENGINE_ECHO
+    **engine_options()
 )
 
 Session = async_sessionmaker(async_engine)
 
-class Base(DeclarativeBase): pass
\ No newline at end of file
+if settings.DB_REPLICA_HOST:
+    read_engine = create_async_engine(
+        url=settings.DATABASE_URL_asyncpg_replica,
+        **engine_options()
+    )
+    ReadSession = async_sessionmaker(read_engine, info={"replica": True})
+else:
+    read_engine = async_engine
+    ReadSession = Session
+
+
+def recent_write_key(user_id: int) -> str:
+    return f"recent_write:{user_id}"
+
+
+async def mark_write(user_id: int):
+    if ReadSession is Session:
+        return
+    # The marker is shared through Redis so that reads on every worker go to
+    # the primary for the window, not only on the worker that took the write.
+    try:
+        await get_redis().set(recent_write_key(user_id), 1, px=int(settings.DB_READ_YOUR_WRITES_WINDOW * 1000)) # type: ignore
+    except Exception as e:
+        print(f"Error marking recent write: {e}")
+
+
+async def read_session(user_id: int | None = None) -> async_sessionmaker:
+    if ReadSession is Session or user_id is None:
+        return ReadSession
+    try:
+        if await get_redis().exists(recent_write_key(user_id)): # type: ignore
+            return Session
+    except Exception as e:
+        print(f"Error checking recent write: {e}")
+        return Session
+    return ReadSession
+
+
+class Base(DeclarativeBase): pass
@@ -9,7 +9,7 @@ from models import UserProfileOrm
 
 from schemas import UserProfileWithContacts
 
-from database import Session
+from database import ReadSession, Session, read_session
 from config import settings
 
 import jwt
@@ -25,6 +25,10 @@ async def get_db() -> AsyncGenerator:
             await session.rollback()
             raise
 
+async def get_replica_db() -> AsyncGenerator:
+    async with ReadSession() as session:
+        yield session
+
 async def get_user(username: str) -> UserProfileWithContacts | None:
     async with Session() as db:
         user = await db.scalar(select(UserProfileOrm)
@@ -59,6 +63,41 @@ async def get_current_user(token= Depends(oauth2_scheme)) -> UserProfileWithCont
     return user
 
 
+async def get_current_user_id(token= Depends(oauth2_scheme)) -> int:
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    try:
+        payload = jwt.decode(token.credentials, settings.PUBLIC_KEY, algorithms=[settings.ALGORITHM])
+        username: str = payload.get("sub")
+        if not username:
+            raise credentials_exception
+    except jwt.ExpiredSignatureError:
+        credentials_exception.detail = "Token has expired"
+        raise credentials_exception
+    except jwt.PyJWTError as a:
+        print(a)
+        raise credentials_exception
+
+    user_id = payload.get("uid")
+    if isinstance(user_id, int):
+        return user_id
+
+    async with Session() as db:
+        user_id = await db.scalar(select(UserProfileOrm.id)
+                                  .filter(UserProfileOrm.username == username))
+    if user_id is None:
+        raise credentials_exception
+    return user_id
+
+
+async def get_read_db(current_user_id: int = Depends(get_current_user_id)) -> AsyncGenerator:
+    async with (await read_session(current_user_id))() as session:
+        yield session
+
+
 async def get_current_user_ws(token: str) -> UserProfileWithContacts:
     try:
         payload = jwt.decode(token, settings.PUBLIC_KEY, algorithms=[settings.ALGORITHM])
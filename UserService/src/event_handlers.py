@@ -1,10 +1,8 @@
-from datetime import datetime
 import asyncio
 from aio_pika import connect_robust, ExchangeType
-from aio_pika.abc import AbstractIncomingMessage
+from aio_pika.abc import AbstractChannel, AbstractIncomingMessage
 import json
 
-from fastapi import WebSocket
 from redis_manager import redis
 
 from sqlalchemy import select
@@ -28,17 +26,31 @@ async def add_user_to_db(id: int, username: str):
         await db.commit()
 
 async def handle_user_registered(message: AbstractIncomingMessage):
-    async with message.process():
+    async with message.process(requeue=False):
         try:
             event = json.loads(message.body.decode())
             if event["type"] == "UserRegistered":
                 user_data = event["data"]
                 await add_user_to_db(user_data['user_id'], user_data['username'])
-                
+
         except Exception as e:
             print(f"Error processing message: {e}")
+            raise
     
 
+DEAD_LETTER_EXCHANGE = "dlx_user_events"
+DEAD_LETTER_QUEUE = "user_events_dead_letter"
+
+
+async def declare_dead_letter_queue(channel: AbstractChannel):
+    exchange = await channel.declare_exchange(
+        name=DEAD_LETTER_EXCHANGE,
+        type=ExchangeType.FANOUT,
+        durable=True)
+    queue = await channel.declare_queue(name=DEAD_LETTER_QUEUE, durable=True)
+    await queue.bind(exchange)
+
+
 async def start_rabbitmq_consumer():
     connection = await connect_robust(host=settings.RABBIT_HOST, login=settings.RABBIT_USER, password=settings.RABBIT_PASS)
     
@@ -49,34 +61,15 @@ async def start_rabbitmq_consumer():
         name="user_events",
         type=ExchangeType.FANOUT,
         durable=True)
+        await declare_dead_letter_queue(channel)
 
         queue = await channel.declare_queue(
         name=f"UserService_user_events",
         durable=True,
         arguments={
-            "x-dead-letter-exchange": "dlx_user_events"
+            "x-dead-letter-exchange": DEAD_LETTER_EXCHANGE
         })
 
         await queue.bind(exchange)
         await queue.consume(handle_user_registered) 
         await asyncio.Future()
-
-
-async def on_offline(websocket: WebSocket, user_id: int, last_seen: datetime | None = None):
-    message = {
-        "event": "status_update",
-        "user_id": str(user_id),
-        "status": "offline",
-        "last_seen": last_seen.isoformat() if last_seen else None
-    }
-    await websocket.send_json(message)
-
-
-async def on_online(websocket: WebSocket, user_id: int, last_seen: datetime | None = None):
-    message = {
-        "event": "status_update",
-        "user_id": str(user_id),
-        "status": "online",
-        "last_seen": last_seen.isoformat() if last_seen else None
-    }
-    await websocket.send_json(message)
\ No newline at end of file
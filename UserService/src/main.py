@@ -1,27 +1,35 @@
 import datetime
 import asyncio
-from fastapi import FastAPI, Depends, HTTPException, Query, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.concurrency import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 
-from sqlalchemy import and_, select, text, update
+from sqlalchemy import and_, func, select, text, update
 from sqlalchemy.ext.asyncio import AsyncSession
 import uvicorn
 
 from event_handlers import start_rabbitmq_consumer
 from models import UserProfileOrm, ContactOrm
 from schemas import UserProfileResponse, UserProfileWithContacts, ContactResponse, ContactCreate
-from dependencies import get_current_user, get_current_user_ws, get_db
-from redis_manager import init_redis, get_redis
-from event_handlers import on_offline, on_online
+from dependencies import get_current_user, get_current_user_id, get_current_user_ws, get_db, get_read_db, get_replica_db
+from database import mark_write
+from etag import etag_matches, make_etag, not_modified
+from redis_manager import init_redis
+from presence import presence_hub, presence_snapshot, presence_tracker
+from config import settings
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     asyncio.create_task(start_rabbitmq_consumer())
     await init_redis()
-    
+    await presence_hub.start()
+    await presence_tracker.start()
+
     yield
 
+    await presence_tracker.stop()
+    await presence_hub.stop()
+
 app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
@@ -30,6 +38,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
 @app.get("/profiles/me", response_model=UserProfileResponse)
@@ -42,7 +51,7 @@ async def get_profile(
 @app.get("/profiles/search", response_model=list[UserProfileResponse])
 async def search_users(
     query: str = Query(..., min_length=2),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_replica_db)
 ):
     results = (await db.execute(text("""
         SELECT * 
@@ -82,14 +91,34 @@ async def add_contact(
 
     await db.commit()
     await db.refresh(db_contact)
+    await mark_write(current_user.id)
     return ContactResponse.model_validate(db_contact)
 
 
 @app.get("/contacts/", response_model=list[UserProfileResponse])
 async def get_contacts(
-    current_user: UserProfileWithContacts = Depends(get_current_user),
+    request: Request,
+    response: Response,
+    current_user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_read_db)
 ):
-    return current_user.contacts
+    # Profiles only change through last_seen, so the contact count, the newest
+    # contact and the latest last_seen are enough to detect any change.
+    version = (await db.execute(select(func.count(),
+                                       func.max(ContactOrm.created_at),
+                                       func.max(UserProfileOrm.last_seen))
+                                .select_from(ContactOrm)
+                                .join(UserProfileOrm, UserProfileOrm.id == ContactOrm.contact_id)
+                                .filter(ContactOrm.user_id == current_user_id))).one()
+    etag = make_etag("contacts", current_user_id, *version)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+
+    contacts = await db.scalars(select(UserProfileOrm)
+                                .join(ContactOrm, UserProfileOrm.id == ContactOrm.contact_id)
+                                .filter(ContactOrm.user_id == current_user_id))
+    return [UserProfileResponse.model_validate(contact) for contact in contacts]
 
 
 @app.websocket("/online")
@@ -105,45 +134,49 @@ async def user_online(
         return
 
     await websocket.accept()
-
-    redis = get_redis()
-    pubsub = redis.pubsub() # type: ignore
-
-    async def reader():
-        while True:
-            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=None)
-            if message is not None:
-                if message["type"] == "pmessage":
-                    user_id = message["data"].decode().split(":")[-1]
-                    if int(user_id) in [user.id for user in user.contacts]:
-                        if message["channel"] == b"__keyevent@0__:expired":
-                            await on_offline(websocket, user_id, datetime.datetime.now())
-                        else:
-                            await on_online(websocket, user_id, datetime.datetime.now())
-
-
-    await pubsub.psubscribe("__keyevent@0__:expired")
-    await pubsub.psubscribe("__keyevent@0__:set")
-    
-    asyncio.create_task(reader())
+    contact_ids = [contact.id for contact in user.contacts]
+    await presence_hub.watch(websocket, contact_ids)
+    await presence_tracker.connect(user.id)
 
     try:
+        # Taken after subscribing, so no transition falls between the
+        # snapshot and the updates that follow it; the hub holds those
+        # updates until the snapshot has gone out.
+        presence_hub.start_sending(websocket, presence_snapshot(await presence_tracker.presence(db, contact_ids)))
         while True:
-            timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat()
-            await get_redis().setex(f"user_status:{user.id}", 300, timestamp) # type: ignore
+            presence_tracker.heartbeat(user.id)
             await websocket.receive_text()
     except WebSocketDisconnect:
         await db.execute(update(UserProfileOrm)
                          .filter(UserProfileOrm.id == user.id)
                          .values(last_seen=datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)))
-        await redis.delete(f"user_status:{user.id}") # type: ignore
+    finally:
+        await presence_hub.unwatch(websocket)
+        await presence_tracker.disconnect(user.id)
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return {
+        "presence": presence_hub.stats(),
+        "presence_tracker": presence_tracker.stats(),
+    }
+
+
+@app.get("/online/bulk")
+async def get_users_online(user_ids: list[int] = Query(...),
+                           current_user_id: int = Depends(get_current_user_id),
+                           db: AsyncSession = Depends(get_read_db)):
+    if len(user_ids) > settings.PRESENCE_BULK_LIMIT:
+        raise HTTPException(status_code=400, detail=f"At most {settings.PRESENCE_BULK_LIMIT} user ids are allowed")
+    return await presence_tracker.presence(db, user_ids)
 
 
 @app.get("/online/{user_id}")
 async def get_user_online(user_id: int,
                           current_user: UserProfileResponse = Depends(get_current_user),
                           db: AsyncSession = Depends(get_db)):
-    user_last_seen = await get_redis().get(f"user_status:{user_id}") # type: ignore
+    user_last_seen = await presence_tracker.last_seen(user_id)
     if user_last_seen is not None:
         return {
             "status": "online",
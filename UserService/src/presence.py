@@ -0,0 +1,446 @@
+import asyncio
+import datetime
+import json
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, Set
+from uuid import uuid4
+
+from fastapi import WebSocket
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import settings
+from database import Session
+from models import UserProfileOrm
+from redis_manager import get_redis
+
+HEARTBEATS_KEY = "presence:heartbeats"
+CONNECTIONS_KEY_PREFIX = "presence:conns:"
+INSTANCES_KEY = "presence:instances"
+CHANNEL_PREFIX = "presence:"
+
+# Removes a bounded batch of stale members atomically, so concurrent
+# sweepers never announce the same user offline twice.
+SWEEP_SCRIPT = """
+local stale = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'WITHSCORES', 'LIMIT', 0, ARGV[2])
+for i = 1, #stale, 2 do
+    redis.call('ZREM', KEYS[1], stale[i])
+end
+return stale
+"""
+
+# Each instance counts its own sockets in presence:conns:{instance}, which
+# expires with the instance. The user goes offline only when this instance's
+# count drops from 1 to 0 and no live instance still has a socket open.
+# Returns 1 if the user was removed.
+DISCONNECT_SCRIPT = """
+local count = redis.call('HINCRBY', KEYS[1], ARGV[1], -1)
+if count > 0 then
+    return 0
+end
+redis.call('HDEL', KEYS[1], ARGV[1])
+if count < 0 then
+    return 0
+end
+for _, instance in ipairs(redis.call('ZRANGEBYSCORE', KEYS[3], ARGV[2], '+inf')) do
+    if tonumber(redis.call('HGET', ARGV[3] .. instance, ARGV[1]) or '0') > 0 then
+        return 0
+    end
+end
+return redis.call('ZREM', KEYS[2], ARGV[1])
+"""
+
+
+def presence_channel(user_id: int) -> str:
+    return f"{CHANNEL_PREFIX}{user_id}"
+
+
+def heartbeat_time(score: float) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(score, datetime.timezone.utc)
+
+
+def presence_entry(user_id: int, status: str, last_seen: datetime.datetime | None = None) -> dict:
+    return {
+        "user_id": str(user_id),
+        "status": status,
+        "last_seen": last_seen.isoformat() if last_seen else None
+    }
+
+
+def status_update(user_id: int, status: str, last_seen: datetime.datetime | None = None) -> str:
+    return json.dumps({"event": "status_update", **presence_entry(user_id, status, last_seen)})
+
+
+def presence_snapshot(entries: list[dict]) -> str:
+    return json.dumps({"event": "presence_snapshot", "users": entries})
+
+
+SLOW_CONSUMER_CLOSE_CODE = 4000
+
+
+class PresenceSocket:
+    def __init__(self, hub: "PresenceHub", websocket: WebSocket):
+        self.hub = hub
+        self.websocket = websocket
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize=settings.PRESENCE_SEND_QUEUE_SIZE)
+        self.closed = False
+        self.writer_task: asyncio.Task | None = None
+
+    def start(self, first_frame: str):
+        if self.closed:
+            return
+        # Updates dispatched before this are held in the queue, so they are
+        # sent after the first frame and applied on top of it.
+        self.writer_task = asyncio.create_task(self.writer(first_frame))
+
+    def send(self, payload: str):
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            self.hub.failed_deliveries += 1
+            asyncio.create_task(self.close(SLOW_CONSUMER_CLOSE_CODE, "Slow consumer: send queue overflow"))
+
+    async def writer(self, first_frame: str):
+        try:
+            await asyncio.wait_for(self.websocket.send_text(first_frame), settings.PRESENCE_SEND_TIMEOUT)
+            while True:
+                payload = await self.queue.get()
+                await asyncio.wait_for(self.websocket.send_text(payload), settings.PRESENCE_SEND_TIMEOUT)
+                self.hub.deliveries += 1
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            self.hub.failed_deliveries += 1
+            await self.close(SLOW_CONSUMER_CLOSE_CODE, "Slow consumer: send timeout")
+        except Exception:
+            self.hub.failed_deliveries += 1
+            await self.close()
+
+    async def close(self, code: int | None = None, reason: str = ""):
+        if self.closed:
+            return
+        self.closed = True
+        if self.writer_task is not None and self.writer_task is not asyncio.current_task():
+            self.writer_task.cancel()
+        if code is not None:
+            try:
+                await asyncio.wait_for(self.websocket.close(code=code, reason=reason), settings.PRESENCE_SEND_TIMEOUT)
+            except Exception:
+                pass
+
+
+class PresenceHub:
+    def __init__(self):
+        self.watchers: Dict[int, Set[PresenceSocket]] = defaultdict(set)
+        self.watched: Dict[WebSocket, tuple[PresenceSocket, Set[int]]] = {}
+        self.pubsub = None
+        self.reader_task: asyncio.Task | None = None
+        self.events = 0
+        self.deliveries = 0
+        self.failed_deliveries = 0
+        self.reconnects = 0
+
+    async def start(self):
+        self.pubsub = get_redis().pubsub() # type: ignore
+        self.reader_task = asyncio.create_task(self.reader())
+
+    async def stop(self):
+        if self.reader_task is not None:
+            self.reader_task.cancel()
+            self.reader_task = None
+        if self.pubsub is not None:
+            await self.pubsub.aclose()
+            self.pubsub = None
+
+    async def watch(self, websocket: WebSocket, user_ids: Iterable[int]):
+        user_ids = set(user_ids)
+        socket = PresenceSocket(self, websocket)
+        self.watched[websocket] = (socket, user_ids)
+        # One subscription per process for each watched user; sockets are
+        # found through the watchers index.
+        channels = [presence_channel(user_id) for user_id in user_ids if user_id not in self.watchers]
+        for user_id in user_ids:
+            self.watchers[user_id].add(socket)
+        if channels:
+            await self.pubsub.subscribe(*channels) # type: ignore
+
+    def start_sending(self, websocket: WebSocket, first_frame: str):
+        entry = self.watched.get(websocket)
+        if entry is not None:
+            entry[0].start(first_frame)
+
+    async def unwatch(self, websocket: WebSocket):
+        entry = self.watched.pop(websocket, None)
+        if entry is None:
+            return
+        socket, user_ids = entry
+        await socket.close()
+        channels = []
+        for user_id in user_ids:
+            sockets = self.watchers.get(user_id)
+            if sockets is None:
+                continue
+            sockets.discard(socket)
+            if not sockets:
+                del self.watchers[user_id]
+                channels.append(presence_channel(user_id))
+        if channels:
+            await self.pubsub.unsubscribe(*channels) # type: ignore
+
+    async def reader(self):
+        failed = False
+        while self.pubsub is not None:
+            try:
+                if failed:
+                    await self.reconnect()
+                    failed = False
+                await self.read()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Presence subscriber failed, reconnecting: {e}")
+                failed = True
+                await asyncio.sleep(1)
+
+    async def reconnect(self):
+        self.reconnects += 1
+        try:
+            await self.pubsub.aclose() # type: ignore
+        except Exception:
+            pass
+        self.pubsub = get_redis().pubsub() # type: ignore
+        channels = [presence_channel(user_id) for user_id in self.watchers]
+        if channels:
+            await self.pubsub.subscribe(*channels) # type: ignore
+
+    async def read(self):
+        while self.pubsub is not None:
+            if self.pubsub.connection is None:
+                # The pubsub connection is only opened by the first subscribe.
+                await asyncio.sleep(1.0)
+                continue
+            message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0) # type: ignore
+            if message is None or message["type"] != "message":
+                continue
+            user_id = int(message["channel"].decode().removeprefix(CHANNEL_PREFIX))
+            self.dispatch(user_id, message["data"].decode())
+
+    def dispatch(self, user_id: int, payload: str):
+        self.events += 1
+        # Each socket has its own send queue, so a slow client never holds
+        # up the reader or other sockets.
+        for socket in list(self.watchers.get(user_id, ())):
+            socket.send(payload)
+
+    def stats(self) -> dict:
+        return {
+            "sockets": len(self.watched),
+            "watched_users": len(self.watchers),
+            "events": self.events,
+            "deliveries": self.deliveries,
+            "failed_deliveries": self.failed_deliveries,
+            "reconnects": self.reconnects,
+        }
+
+
+class PresenceTracker:
+    def __init__(self, timeout: float, heartbeat_interval: float, flush_window: float,
+                 sweep_interval: float, sweep_batch_size: int):
+        self.timeout = timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.flush_window = flush_window
+        self.sweep_interval = sweep_interval
+        self.sweep_batch_size = sweep_batch_size
+        self.instance = uuid4().hex
+        self.instance_ttl = max(int(sweep_interval * 3), 30)
+        self.connections: Dict[int, int] = defaultdict(int)
+        self.last_heartbeat: Dict[int, float] = {}
+        self.pending: Dict[int, float] = {}
+        self.wakeup = asyncio.Event()
+        self.sweep_script = None
+        self.disconnect_script = None
+        self.tasks: list[asyncio.Task] = []
+        self.heartbeats = 0
+        self.written_heartbeats = 0
+        self.transitions = 0
+        self.swept = 0
+
+    async def start(self):
+        self.sweep_script = get_redis().register_script(SWEEP_SCRIPT) # type: ignore
+        self.disconnect_script = get_redis().register_script(DISCONNECT_SCRIPT) # type: ignore
+        await self.refresh_instance()
+        self.tasks = [asyncio.create_task(self.flusher()), asyncio.create_task(self.sweeper())]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+        await self.flush()
+        async with get_redis().pipeline(transaction=False) as pipe: # type: ignore
+            pipe.zrem(INSTANCES_KEY, self.instance)
+            pipe.delete(self.connections_key)
+            await pipe.execute()
+
+    @property
+    def connections_key(self) -> str:
+        return f"{CONNECTIONS_KEY_PREFIX}{self.instance}"
+
+    async def refresh_instance(self):
+        now = time.time()
+        async with get_redis().pipeline(transaction=False) as pipe: # type: ignore
+            pipe.zadd(INSTANCES_KEY, {self.instance: now + self.instance_ttl})
+            pipe.zremrangebyscore(INSTANCES_KEY, "-inf", now)
+            pipe.expire(self.connections_key, self.instance_ttl)
+            await pipe.execute()
+
+    async def connect(self, user_id: int):
+        self.connections[user_id] += 1
+        async with get_redis().pipeline(transaction=False) as pipe: # type: ignore
+            pipe.hincrby(self.connections_key, str(user_id), 1)
+            pipe.expire(self.connections_key, self.instance_ttl)
+            await pipe.execute()
+
+    def heartbeat(self, user_id: int):
+        self.heartbeats += 1
+        now = time.time()
+        # The sweeper only needs a heartbeat well within the timeout, so
+        # chatty sockets cost one write per interval.
+        if now - self.last_heartbeat.get(user_id, 0) < self.heartbeat_interval:
+            return
+        self.last_heartbeat[user_id] = now
+        self.pending[user_id] = now
+        self.wakeup.set()
+
+    async def disconnect(self, user_id: int):
+        self.connections[user_id] -= 1
+        if self.connections[user_id] <= 0:
+            del self.connections[user_id]
+            self.last_heartbeat.pop(user_id, None)
+            self.pending.pop(user_id, None)
+        if await self.disconnect_script(keys=[self.connections_key, HEARTBEATS_KEY, INSTANCES_KEY], # type: ignore
+                                        args=[user_id, time.time(), CONNECTIONS_KEY_PREFIX]):
+            self.transitions += 1
+            now = datetime.datetime.now(datetime.timezone.utc)
+            await get_redis().publish(presence_channel(user_id), status_update(user_id, "offline", now)) # type: ignore
+
+    async def flusher(self):
+        while True:
+            await self.wakeup.wait()
+            await asyncio.sleep(self.flush_window)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error writing presence heartbeats: {e}")
+
+    async def flush(self):
+        self.wakeup.clear()
+        heartbeats, self.pending = self.pending, {}
+        if not heartbeats:
+            return
+
+        async with get_redis().pipeline(transaction=False) as pipe: # type: ignore
+            for user_id, score in heartbeats.items():
+                pipe.zadd(HEARTBEATS_KEY, {user_id: score})
+            added = await pipe.execute()
+        self.written_heartbeats += len(heartbeats)
+
+        # ZADD only counts new members, which are exactly the users that
+        # just came online; refreshed heartbeats publish nothing.
+        online = [(user_id, score) for (user_id, score), new in zip(heartbeats.items(), added) if new]
+        if online:
+            async with get_redis().pipeline(transaction=False) as pipe: # type: ignore
+                for user_id, score in online:
+                    pipe.publish(presence_channel(user_id), status_update(user_id, "online", heartbeat_time(score)))
+                await pipe.execute()
+            self.transitions += len(online)
+
+    async def sweeper(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.refresh_instance()
+                while await self.sweep() == self.sweep_batch_size:
+                    pass
+            except Exception as e:
+                print(f"Error sweeping presence: {e}")
+
+    async def sweep(self) -> int:
+        stale = await self.sweep_script(keys=[HEARTBEATS_KEY], args=[time.time() - self.timeout, self.sweep_batch_size]) # type: ignore
+        if not stale:
+            return 0
+        scores = {int(stale[i]): float(stale[i + 1]) for i in range(0, len(stale), 2)}
+        offline = [(user_id, heartbeat_time(score)) for user_id, score in scores.items()]
+
+        try:
+            async with Session() as db:
+                await db.execute(update(UserProfileOrm), [
+                    {"id": user_id, "last_seen": last_seen.replace(tzinfo=None)}
+                    for user_id, last_seen in offline
+                ])
+                await db.commit()
+        except Exception:
+            # Put the users back so the next sweep retries them; NX keeps a
+            # heartbeat that arrived in the meantime.
+            await get_redis().zadd(HEARTBEATS_KEY, scores, nx=True) # type: ignore
+            raise
+
+        async with get_redis().pipeline(transaction=False) as pipe: # type: ignore
+            for user_id, last_seen in offline:
+                pipe.publish(presence_channel(user_id), status_update(user_id, "offline", last_seen))
+            await pipe.execute()
+
+        self.transitions += len(offline)
+        self.swept += len(offline)
+        return len(offline)
+
+    async def last_seen(self, user_id: int) -> datetime.datetime | None:
+        score = await get_redis().zscore(HEARTBEATS_KEY, user_id) # type: ignore
+        if score is None or score < time.time() - self.timeout:
+            return None
+        return heartbeat_time(score)
+
+    async def last_seen_many(self, user_ids: list[int]) -> list[datetime.datetime | None]:
+        if not user_ids:
+            return []
+        cutoff = time.time() - self.timeout
+        scores = await get_redis().zmscore(HEARTBEATS_KEY, user_ids) # type: ignore
+        return [heartbeat_time(score) if score is not None and score >= cutoff else None for score in scores]
+
+    async def presence(self, db: AsyncSession, user_ids: list[int]) -> list[dict]:
+        user_ids = list(dict.fromkeys(user_ids))
+        online = dict(zip(user_ids, await self.last_seen_many(user_ids)))
+        offline = [user_id for user_id, last_seen in online.items() if last_seen is None]
+        last_seen = {}
+        if offline:
+            last_seen = dict((await db.execute(select(UserProfileOrm.id, UserProfileOrm.last_seen)
+                                               .filter(UserProfileOrm.id.in_(offline)))).all())
+
+        entries = []
+        for user_id in user_ids:
+            if online[user_id] is not None:
+                entries.append(presence_entry(user_id, "online", online[user_id]))
+            elif user_id in last_seen:
+                entries.append(presence_entry(user_id, "offline", last_seen[user_id]))
+        return entries
+
+    def stats(self) -> dict:
+        return {
+            "connected_users": len(self.connections),
+            "heartbeats": self.heartbeats,
+            "written_heartbeats": self.written_heartbeats,
+            "transitions": self.transitions,
+            "swept": self.swept,
+        }
+
+
+presence_hub = PresenceHub()
+presence_tracker = PresenceTracker(
+    timeout=settings.PRESENCE_TIMEOUT,
+    heartbeat_interval=settings.PRESENCE_HEARTBEAT_INTERVAL,
+    flush_window=settings.PRESENCE_FLUSH_WINDOW_MS / 1000,
+    sweep_interval=settings.PRESENCE_SWEEP_INTERVAL,
+    sweep_batch_size=settings.PRESENCE_SWEEP_BATCH_SIZE
+)